@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Utterance
+from .models import Session, Utterance
 # Register your models here.
 
 @admin.register(Utterance)
@@ -9,3 +9,9 @@ class UtteranceAdmin(admin.ModelAdmin):
     search_fields = ('text', 'session_id')
     date_hierarchy = 'timestamp'
 
+
+@admin.register(Session)
+class SessionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'started_at', 'ended_at')
+    search_fields = ('id',)
+    date_hierarchy = 'started_at'
@@ -3,46 +3,44 @@
 # generaL behavior
 import os
 import time
-from llama_cpp import Llama
+import threading
 
 # for logging:
 import warnings, logging
 
-#for TTS
-import azure.cognitiveservices.speech as speechsdk
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 ######################################################### set API keys
 
 # MS Auzre / used at 'tts.py' and 'asr.py' files
 speech_key, service_region = "3249fb4e6d8248569b42d5dbf693c259", "eastus"
-speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
+# speech_config / audio_config are created on first use (see __getattr__ below), so the web app and
+# management commands never load the Azure SDK or open a microphone
 # audio_config = speechsdk.audio.AudioConfig(device_name="{0.0.1.00000000}.{9485502f-1e25-43a1-b32e-f2064ed250be}")
 # audio_config = speechsdk.audio.AudioConfig(device_name="{0.0.1.00000000}.{c600777f-5cb7-44a2-9457-68fe97eb7632}")
 
 audio_device_name = os.getenv("AUDIO_DEVICE_NAME", None)
-if audio_device_name:
-    audio_config = speechsdk.audio.AudioConfig(device_name=audio_device_name)
-else:
-    audio_config = speechsdk.audio.AudioConfig(use_default_microphone=True)
+# 'azure' or 'fake' (dementia_chat/services/fake_speech.py: scripted recognition, silent synthesis, no key needed)
+speech_sdk = os.getenv("SPEECH_SDK", "azure")
 
 ######################################################### set logging
 
 # Ignoring the warnings
 warnings.filterwarnings(action='ignore')
 
-# Making the 'logs' folder if the folder does not exist
-if not os.path.exists("./logs/"):
-    os.mkdir("./logs/")
+class LogFileHandler(logging.FileHandler):
+    '''File handler that makes the 'logs' folder when the first record is written, not at import'''
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
 
-if not os.path.exists("./script/"):
-    os.mkdir("./script/")
 
 # Set up log file written format ex) 01:39:09
 logging.basicConfig(
     format="%(asctime)s %(levelname)s: %(name)s: %(message)s",
     level=logging.DEBUG,
-    filename='./logs/dm.log',
+    handlers=[LogFileHandler('./logs/dm.log', delay=True)],
     # encoding='utf-8',
     datefmt="%H:%M:%S",
     #stream=sys.stderr,
@@ -53,42 +51,182 @@ logger = logging.getLogger(__name__)
 
 ######################################################### set asr
 
-script_check = 1
-chat_history = list()
 THIS_LANGUAGE = 'en-US'
 game_start_time = time.time()
 overlap_check = 0
-script_path = './Script/Script' +"("+time.strftime('%y-%m-%d %H-%M', time.localtime(time.time()))+")"+'.csv'
+# continuous recognition feeding separate LLM and speech threads, so listening overlaps replying
+asr_pipelined = os.getenv("ASR_PIPELINED", "0") == "1"
+# transcript files ('csv', 'csv.gz' or 'parquet'), written every script_flush_size rows or script_flush_interval seconds
+script_dir = './Script'
+script_format = os.getenv("SCRIPT_FORMAT", "csv")
+script_flush_size = int(os.getenv("SCRIPT_FLUSH_SIZE", 20))
+script_flush_interval = float(os.getenv("SCRIPT_FLUSH_INTERVAL", 5))
 
 ######################################################### set global variables
 
 voice = f"Microsoft Server Speech Text to Speech Voice ({THIS_LANGUAGE}, JennyNeural)"
-speech_config.speech_synthesis_voice_name = voice
 
 ######################################################### set llm settings
 
 current_path = os.path.dirname(os.path.abspath(__file__))
 
 max_length = 256
+# context window of the model, and how much of it is kept free for the reply; history fills the rest
+n_ctx = int(os.getenv("LLM_N_CTX", max_length))
+max_new_tokens = int(os.getenv("LLM_MAX_NEW_TOKENS", 64))
 prompt = "You are an assistant for dementia patients. Provide any response as much short as possible."
 
-try:
-    model_path = current_path + "/services/Phi-3_finetuned.gguf"
-    if not os.path.exists(model_path):
-        logger.error(f"Model file not found: {model_path}")
-        raise FileNotFoundError(f"Model file not found: {model_path}")
-        
-    llm = Llama(
-        model_path=model_path,
-        n_ctx=max_length,
-        n_threads=16,
-        n_gpu_layers=0
-    )
-    logger.info("LLM initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize LLM: {e}")
-    raise
+# 'llama_cpp' (GGUF in this process), 'server' (llama.cpp server at LLM_SERVER_URL) or 'stub' (canned replies)
+llm_backend = os.getenv("LLM_BACKEND", "llama_cpp")
+llm_server_url = os.getenv("LLM_SERVER_URL", "http://localhost:8080")
+# requests the llama.cpp server handles at once (its --parallel slots)
+llm_server_parallel = int(os.getenv("LLM_SERVER_PARALLEL", 1))
+# seconds before the first stub token and between tokens
+llm_stub_latency = float(os.getenv("LLM_STUB_LATENCY", 0.2))
+llm_stub_token_latency = float(os.getenv("LLM_STUB_TOKEN_LATENCY", 0.02))
+llm_stub_concurrency = int(os.getenv("LLM_STUB_CONCURRENCY", 64))
+llm_queue_size = int(os.getenv("LLM_QUEUE_SIZE", 8))
+llm_timeout = float(os.getenv("LLM_TIMEOUT", 30))
+# push llm_response_delta frames to the browser while the reply is generated
+llm_stream = os.getenv("LLM_STREAM", "1") == "1"
+# saved KV states kept for the most recently active sessions (each one holds up to n_ctx tokens of KV cache)
+llm_session_states = int(os.getenv("LLM_SESSION_STATES", 4))
+# cached replies for repeated questions (0 disables), seconds they stay valid, history utterances they
+# must share (default 1: the reply the patient is answering; 0 opts in to context-free replies shared by every
+# conversation), and the word overlap (Jaccard, 0-1) at which a similar question counts as a repeat (unset:
+# exact only)
+response_cache_size = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))
+response_cache_ttl = float(os.getenv("RESPONSE_CACHE_TTL", 600))
+response_cache_context = int(os.getenv("RESPONSE_CACHE_CONTEXT", 1))
+response_cache_similarity = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0)) or None
+# most history turns put in the prompt
+history_turns = 5
+busy_message = "I'm still thinking about what you said before. Could you say that again in a moment?"
+
+model_path = current_path + "/services/Phi-3_finetuned.gguf"
+llm_options = {
+    "llama_cpp": dict(model_path=model_path, n_ctx=n_ctx, n_threads=16, n_gpu_layers=0,
+                      session_states=llm_session_states),
+    "server": dict(url=llm_server_url, timeout=llm_timeout, parallel=llm_server_parallel),
+    "stub": dict(latency=llm_stub_latency, token_latency=llm_stub_token_latency,
+                 concurrency=llm_stub_concurrency),
+}
+
+# inference worker threads: as many requests as the backend serves at once (a Llama instance is not thread-safe)
+llm_workers = {"llama_cpp": 1, "server": llm_server_parallel, "stub": llm_stub_concurrency}.get(llm_backend, 1)
+# every worker needs a queue slot, or the extra workers would sit idle
+llm_queue_size = max(llm_queue_size, llm_workers)
+
+# seconds between periodic anomia/turn-taking scores; sessions silent for periodic_idle_timeout are skipped
+periodic_scores_interval = float(os.getenv("PERIODIC_SCORES_INTERVAL", 5))
+periodic_idle_timeout = 60
+
+# sliding windows (seconds) over which fillers per minute are reported, besides since-connect
+anomia_windows = (60, 300)
+
+# utterances are written in batches of this size, or after this many seconds
+db_flush_size = int(os.getenv("DB_FLUSH_SIZE", 50))
+db_flush_interval = float(os.getenv("DB_FLUSH_INTERVAL", 1.0))
 
 ######### PROSODY & PRONUNCIATION MODEL PATHS #############
 pronunciation_model_path = "dementia_chat/services/pronunciation_rf(v4).pkl"
-prosody_model_path = "dementia_chat/services/prosody_rf(v1).pkl"
\ No newline at end of file
+prosody_model_path = "dementia_chat/services/prosody_rf(v1).pkl"
+
+# use the array-backed forests written next to the pickles by 'manage.py compile_forests'
+if os.getenv("COMPILED_FORESTS", "0") == "1":
+    pronunciation_model_path = os.path.splitext(pronunciation_model_path)[0] + ".npz"
+    prosody_model_path = os.path.splitext(prosody_model_path)[0] + ".npz"
+
+# prosody/pronunciation models score 5 s windows; a new overlapping window is scored every hop (seconds)
+biomarker_hop = float(os.getenv("BIOMARKER_HOP", 2.5))
+
+# openSMILE worker processes (0 extracts on a thread in the web process) and chunks queued per session
+feature_workers = int(os.getenv("FEATURE_WORKERS", os.cpu_count() or 1))
+feature_queue_size = 2
+# reduced openSMILE config producing only the 28 biomarker LLDs; set OPENSMILE_LLD_CONFIG= (empty) for the full
+# ComParE_2016 set
+lld_config = os.getenv("OPENSMILE_LLD_CONFIG", current_path + "/services/biomarker_lld.conf") or None
+lld_level = os.getenv("OPENSMILE_LLD_LEVEL", "lld")
+# also extract the full ComParE_2016 set for every chunk and check the reduced config's frames are identical
+lld_verify = os.getenv("OPENSMILE_LLD_VERIFY", "0") == "1"
+
+# windows from all sessions are scored together: collect for up to this many seconds / rows
+scoring_batch_window = float(os.getenv("SCORING_BATCH_WINDOW", 0.005))
+scoring_max_batch = int(os.getenv("SCORING_MAX_BATCH", 64))
+
+# models are shared per process; 'r' memory-maps plain numpy arrays of joblib dumps (not sklearn tree nodes)
+model_mmap_mode = os.getenv("MODEL_MMAP_MODE") or None
+# seconds between checks for a changed .pkl on disk (None disables hot reload)
+model_reload_interval = 10
+
+######################################################### set scaling
+
+# seconds a disconnected session's state is kept so the client can resume it on any front-end
+session_state_ttl = int(os.getenv("SESSION_STATE_TTL", 3600))
+# send LLM turns and openSMILE chunks to 'manage.py runworker llm-inference feature-extraction'
+remote_workers = os.getenv("REMOTE_WORKERS", "0") == "1"
+llm_channel = "llm-inference"
+feature_channel = "feature-extraction"
+
+######################################################### lazy initialization
+
+# loaded in the background when the ASGI app starts ('llm', 'models'); /ready reports when they are done
+warm_up = [name for name in os.getenv("WARM_UP", "llm,models").split(",") if name]
+
+
+def _create_llm():
+    try:
+        from dementia_chat.services.llm import create_backend
+        backend = create_backend(llm_backend, **llm_options.get(llm_backend, {}))
+        logger.info("LLM initialized successfully")
+        return backend
+    except Exception as e:
+        logger.error(f"Failed to initialize LLM: {e}")
+        raise
+
+
+def _create_speechsdk():
+    if speech_sdk == "fake":
+        from dementia_chat.services import fake_speech
+        return fake_speech
+    import azure.cognitiveservices.speech as speechsdk
+    return speechsdk
+
+
+def _create_speech_config():
+    speechsdk = __getattr__("speechsdk")
+    config = speechsdk.SpeechConfig(subscription=speech_key, region=service_region)
+    config.speech_synthesis_voice_name = voice
+    return config
+
+
+def _create_audio_config():
+    speechsdk = __getattr__("speechsdk")
+    if audio_device_name:
+        return speechsdk.audio.AudioConfig(device_name=audio_device_name)
+    return speechsdk.audio.AudioConfig(use_default_microphone=True)
+
+
+_lazy = {
+    "llm": _create_llm,
+    "speechsdk": _create_speechsdk,
+    "speech_config": _create_speech_config,
+    "audio_config": _create_audio_config,
+}
+# reentrant: speech_config and audio_config load speechsdk while holding it
+_lazy_lock = threading.RLock()
+
+
+def __getattr__(name):
+    # Called only for names not yet in the module: build them once, on first use, from any thread
+    if name not in _lazy:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _lazy_lock:
+        if name not in globals():
+            globals()[name] = _lazy[name]()
+    return globals()[name]
+
+
+def is_loaded(name):
+    'Whether a lazily created object (llm, speechsdk, speech_config, audio_config) exists yet'
+    return name in globals()
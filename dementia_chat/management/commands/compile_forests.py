@@ -0,0 +1,69 @@
+import os
+from pathlib import Path
+from time import perf_counter
+
+import joblib
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from dementia_chat.services.forest import CompiledForest
+
+SERVICES_DIR = Path(__file__).resolve().parents[2] / 'services'
+
+
+def synthetic_windows(compiled, n_samples, seed=0):
+    'Random rows spanning the threshold range of every feature, so all branches get exercised'
+    rng = np.random.default_rng(seed)
+    low = np.zeros(compiled.n_features_in_)
+    high = np.ones(compiled.n_features_in_)
+    split = np.isfinite(compiled.threshold)
+    for feature in np.unique(compiled.feature[split]):
+        thresholds = compiled.threshold[split & (compiled.feature == feature)]
+        margin = max(thresholds.max() - thresholds.min(), 1.0) * 0.1
+        low[feature], high[feature] = thresholds.min() - margin, thresholds.max() + margin
+    return rng.uniform(low, high, size=(n_samples, compiled.n_features_in_))
+
+
+class Command(BaseCommand):
+    help = "Compile the biomarker random forests to NumPy node arrays (.npz) and check parity with predict_proba"
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help="Pickled forests to compile (default: all .pkl in services/)")
+        parser.add_argument('--windows', help="Recorded feature windows (.npy, one window per row) for the parity check")
+        parser.add_argument('--samples', type=int, default=1000, help="Synthetic rows to check when --windows is not given")
+        parser.add_argument('--tolerance', type=float, default=1e-9, help="Largest allowed probability difference")
+
+    def handle(self, *args, **options):
+        paths = options['models'] or sorted(str(path) for path in SERVICES_DIR.glob('*.pkl'))
+        if not paths:
+            raise CommandError(f"No models found in {SERVICES_DIR}")
+
+        for path in paths:
+            start = perf_counter()
+            forest = joblib.load(path)
+            pickle_seconds = perf_counter() - start
+            compiled = CompiledForest.from_estimator(forest)
+
+            if options['windows']:
+                X = np.load(options['windows'])
+                X = X.reshape(X.shape[0], -1)
+                if X.shape[1] != forest.n_features_in_:
+                    raise CommandError(f"{path} expects {forest.n_features_in_} features, windows have {X.shape[1]}")
+            else:
+                X = synthetic_windows(compiled, options['samples'])
+
+            error = np.abs(forest.predict_proba(X) - compiled.predict_proba(X)).max()
+            if error > options['tolerance']:
+                raise CommandError(f"{path}: compiled forest differs from predict_proba by {error:g}")
+
+            output = os.path.splitext(path)[0] + '.npz'
+            compiled.save(output)
+            start = perf_counter()
+            CompiledForest.load(output)
+            npz_seconds = perf_counter() - start
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{path} -> {output}: {len(X)} windows match (max diff {error:g}), "
+                f"{compiled.feature.size} nodes, {os.path.getsize(path) / 1e6:.1f} MB -> "
+                f"{os.path.getsize(output) / 1e6:.1f} MB, load {pickle_seconds:.2f}s -> {npz_seconds:.3f}s"
+            ))
@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dementia_chat.services.export import FORMATS, ExportError, export, parse_bound
+
+
+class Command(BaseCommand):
+    help = "Stream utterances to a CSV, JSONL or Parquet file with flat memory use"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--start', help="Earliest timestamp to export (ISO date or datetime)")
+        parser.add_argument('--end', help="Timestamp to export up to, exclusive (ISO date or datetime)")
+        parser.add_argument('--session', action='append', default=[], help="Session id to export (repeatable)")
+        parser.add_argument('--output', '-o', help="Output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            chunks = export(
+                options['format'],
+                start=parse_bound(options['start']),
+                end=parse_bound(options['end']),
+                sessions=options['session'],
+            )
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            written = 0
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
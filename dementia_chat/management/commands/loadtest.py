@@ -0,0 +1,301 @@
+import asyncio
+import base64
+import json
+import os
+import random
+import wave
+from collections import defaultdict, deque
+from time import perf_counter
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from dementia_chat.websocket.protocol import AUDIO_FRAME, encode_frame
+
+SAMPLE_RATE = 16000
+
+UTTERANCES = [
+    "good morning how are you today",
+    "um i went to the uh the shop yesterday",
+    "i can't remember what it is called the thing you write with",
+    "my daughter is coming to visit this weekend",
+    "hmm what day is it today",
+    "i used to work as a teacher uh for many years",
+    "the weather is nice we could go for a walk",
+    "ah i forgot what i was going to say",
+]
+
+
+def synthetic_speech(seconds, sample_rate=SAMPLE_RATE, seed=0):
+    'Voiced-sounding int16 PCM: a gliding pitch with harmonics, syllable envelope and noise'
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 120 + 30 * np.sin(2 * np.pi * 0.5 * t) + rng.normal(0, 2, t.size).cumsum() / sample_rate
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+    audio = voice * envelope + rng.normal(0, 0.05, t.size)
+    return (audio / np.abs(audio).max() * 0.5 * 32767).astype(np.int16)
+
+
+def read_wav(path):
+    'Mono 16-bit PCM and its sample rate from a WAV file'
+    with wave.open(path, 'rb') as recording:
+        if recording.getsampwidth() != 2:
+            raise CommandError(f"{path}: only 16-bit PCM WAV files are supported")
+        samples = np.frombuffer(recording.readframes(recording.getnframes()), dtype='<i2')
+        channels = recording.getnchannels()
+        sample_rate = recording.getframerate()
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples, sample_rate
+
+
+def process_rss():
+    'Resident memory in bytes of this process and its children (e.g. openSMILE workers), by pid'
+    pid = os.getpid()
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    # The process name may contain spaces, so split after its closing parenthesis
+                    if int(stat.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    rss = {}
+    for child in pids:
+        try:
+            with open(f'/proc/{child}/statm') as statm:
+                rss[child] = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            continue
+    return rss
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'p50': p50, 'p95': p95, 'p99': p99, 'max': max(values)}
+
+
+class SimulatedPatient:
+    '''
+    One synthetic client: streams audio chunks in real time, speaks a transcription every turn_interval
+    seconds (with jitter) and occasionally talks over the assistant while its reply is streaming.
+    '''
+
+    def __init__(self, index, application, audio, sample_rate, options, stats):
+        self.index = index
+        self.application = application
+        self.audio = audio
+        self.sample_rate = sample_rate
+        self.options = options
+        self.stats = stats
+        self.random = random.Random(options['seed'] + index)
+        self.sent_turns = deque()
+        self.awaiting_scores = deque()
+
+    async def run(self, stop_at):
+        from channels.testing import WebsocketCommunicator
+
+        communicator = WebsocketCommunicator(self.application, '/ws/chat/')
+        connected, _ = await communicator.connect(timeout=self.options['connect_timeout'])
+        if not connected:
+            self.stats['errors']['connect'] += 1
+            return
+        receiver = asyncio.create_task(self.receive(communicator))
+        try:
+            await asyncio.gather(self.send_audio(communicator, stop_at), self.converse(communicator, stop_at))
+            # Give replies to the last turns a chance to arrive
+            deadline = perf_counter() + self.options['drain']
+            while self.sent_turns and perf_counter() < deadline:
+                await asyncio.sleep(0.05)
+        finally:
+            receiver.cancel()
+            await communicator.disconnect()
+
+    async def send_audio(self, communicator, stop_at):
+        chunk = int(self.options['audio_interval'] * self.sample_rate)
+        position = self.random.randrange(0, max(self.audio.size - chunk, 1))
+        sequence = 0
+        while perf_counter() < stop_at:
+            samples = np.take(self.audio, range(position, position + chunk), mode='wrap')
+            position = (position + chunk) % self.audio.size
+            if self.options['json_audio']:
+                await communicator.send_to(text_data=json.dumps({
+                    'type': 'audio_data',
+                    'data': base64.b64encode(samples.tobytes()).decode(),
+                    'sampleRate': self.sample_rate,
+                }))
+            else:
+                await communicator.send_to(bytes_data=encode_frame(AUDIO_FRAME, self.sample_rate, sequence, samples))
+            sequence += 1
+            self.stats['sent']['audio'] += 1
+            await asyncio.sleep(self.options['audio_interval'])
+
+    async def converse(self, communicator, stop_at):
+        # Clients start at random points in the first turn interval so turns do not arrive in lockstep
+        await asyncio.sleep(self.random.uniform(0, self.options['turn_interval']))
+        while perf_counter() < stop_at:
+            sent = perf_counter()
+            self.sent_turns.append(sent)
+            self.awaiting_scores.append(sent)
+            await communicator.send_to(text_data=json.dumps({
+                'type': 'transcription',
+                'data': self.random.choice(UTTERANCES),
+            }))
+            self.stats['sent']['transcription'] += 1
+            await asyncio.sleep(self.options['turn_interval'] * self.random.uniform(0.5, 1.5))
+
+    async def receive(self, communicator):
+        first_delta = overlapped = None
+        while True:
+            message = json.loads(await communicator.receive_from(timeout=3600))
+            now = perf_counter()
+            kind = message['type']
+            self.stats['received'][kind] += 1
+            if kind == 'biomarker_scores' and self.awaiting_scores:
+                self.stats['latency']['biomarker_scores'].append(now - self.awaiting_scores.popleft())
+            elif kind == 'llm_response_delta' and self.sent_turns and first_delta is None:
+                first_delta = now
+                self.stats['latency']['first_token'].append(now - self.sent_turns[0])
+                # Barge in once the reply has started streaming
+                if self.random.random() < self.options['overlap_rate']:
+                    overlapped = perf_counter()
+                    await communicator.send_to(text_data=json.dumps({'type': 'overlapped_speech'}))
+                    self.stats['sent']['overlapped_speech'] += 1
+            elif kind == 'llm_cancelled' and self.sent_turns:
+                # The oldest turn was cut off, by our overlapped speech or by our next transcription
+                self.sent_turns.popleft()
+                if overlapped is not None:
+                    self.stats['latency']['barge_in'].append(now - overlapped)
+                first_delta = overlapped = None
+            elif kind in ('llm_response', 'busy') and self.sent_turns:
+                self.stats['latency'][kind].append(now - self.sent_turns.popleft())
+                first_delta = overlapped = None
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate concurrent patients against interface_app.asgi:application in-process and report "
+        "biomarker_scores / llm_response latency percentiles, throughput and RSS. Runs offline; it uses the "
+        "configured database and LLM backend (LLM_BACKEND=stub avoids loading the model)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10, help="Concurrent simulated patients")
+        parser.add_argument('--duration', type=float, default=60, help="Seconds of traffic per client")
+        parser.add_argument('--ramp', type=float, default=5, help="Seconds over which clients connect")
+        parser.add_argument('--turn-interval', type=float, default=8, help="Mean seconds between transcriptions")
+        parser.add_argument('--audio-interval', type=float, default=0.5, help="Seconds of audio per chunk")
+        parser.add_argument('--overlap-rate', type=float, default=0.1,
+                            help="Chance the patient talks over a streaming reply")
+        parser.add_argument('--audio', help="16-bit PCM WAV to stream (default: synthetic speech)")
+        parser.add_argument('--json-audio', action='store_true', help="Send legacy base64 audio_data messages")
+        parser.add_argument('--response-cache', action='store_true',
+                            help="Keep the response cache on (off by default: the few synthetic utterances would "
+                                 "mostly be answered from it and the LLM would barely be measured)")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--drain', type=float, default=30, help="Seconds to wait for outstanding replies")
+        parser.add_argument('--connect-timeout', type=float, default=30)
+        parser.add_argument('--output', '-o', help="Also write the report as JSON to this file")
+        parser.add_argument('--max-p95', action='append', default=[], metavar='METRIC=SECONDS',
+                            help="Fail if a latency p95 exceeds the limit, e.g. llm_response=3 (repeatable)")
+
+    def handle(self, *args, **options):
+        limits = {}
+        for limit in options['max_p95']:
+            metric, _, seconds = limit.partition('=')
+            try:
+                limits[metric] = float(seconds)
+            except ValueError:
+                raise CommandError(f"Invalid --max-p95 {limit}, expected METRIC=SECONDS")
+
+        if options['audio']:
+            audio, sample_rate = read_wav(options['audio'])
+        else:
+            audio, sample_rate = synthetic_speech(30, seed=options['seed']), SAMPLE_RATE
+
+        report = asyncio.run(self.run(audio, sample_rate, options))
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+        failed = [
+            f"{metric} p95 {report['latency'][metric].get('p95', float('inf')):.3f}s > {limit}s"
+            for metric, limit in limits.items()
+            if report['latency'].get(metric, {}).get('p95', float('inf')) > limit
+        ]
+        if failed:
+            raise CommandError("; ".join(failed))
+
+    async def run(self, audio, sample_rate, options):
+        from interface_app.asgi import application
+        from dementia_chat.services.response_cache import response_cache
+
+        if not options['response_cache']:
+            response_cache.max_entries = 0
+
+        stats = {
+            'sent': defaultdict(int), 'received': defaultdict(int), 'errors': defaultdict(int),
+            'latency': defaultdict(list),
+        }
+        peak_rss = defaultdict(int)
+
+        async def sample_rss():
+            while True:
+                for pid, rss in process_rss().items():
+                    peak_rss[pid] = max(peak_rss[pid], rss)
+                await asyncio.sleep(1)
+
+        async def patient(index):
+            await asyncio.sleep(options['ramp'] * index / max(options['clients'], 1))
+            client = SimulatedPatient(index, application, audio, sample_rate, options, stats)
+            try:
+                await client.run(perf_counter() + options['duration'])
+            except Exception as e:
+                stats['errors'][type(e).__name__] += 1
+
+        sampler = asyncio.create_task(sample_rss())
+        start = perf_counter()
+        await asyncio.gather(*(patient(index) for index in range(options['clients'])))
+        elapsed = perf_counter() - start
+        sampler.cancel()
+
+        return {
+            'clients': options['clients'],
+            'elapsed': elapsed,
+            'sent': dict(stats['sent']),
+            'received': dict(stats['received']),
+            'errors': dict(stats['errors']),
+            'cancelled_turns': stats['received']['llm_cancelled'],
+            'throughput': {
+                'turns_per_second': stats['received']['llm_response'] / elapsed,
+                'audio_chunks_per_second': stats['sent']['audio'] / elapsed,
+                'messages_per_second': sum(stats['received'].values()) / elapsed,
+            },
+            'latency': {metric: percentiles(values) for metric, values in stats['latency'].items()},
+            'peak_rss_mb': {str(pid): rss / 1e6 for pid, rss in peak_rss.items()},
+        }
+
+    def print_report(self, report):
+        self.stdout.write(f"{report['clients']} clients for {report['elapsed']:.1f}s")
+        self.stdout.write(f"sent {report['sent']}, received {report['received']}")
+        self.stdout.write(f"cancelled turns: {report['cancelled_turns']}")
+        if report['errors']:
+            self.stdout.write(self.style.ERROR(f"errors {report['errors']}"))
+        for name, value in report['throughput'].items():
+            self.stdout.write(f"{name:>24}: {value:.2f}")
+        for metric, summary in sorted(report['latency'].items()):
+            if summary['count']:
+                self.stdout.write(
+                    f"{metric:>24}: n={summary['count']} p50={summary['p50'] * 1000:.0f}ms "
+                    f"p95={summary['p95'] * 1000:.0f}ms p99={summary['p99'] * 1000:.0f}ms"
+                )
+        self.stdout.write(f"peak RSS: {sum(report['peak_rss_mb'].values()):.0f} MB total")
+        for pid, rss in sorted(report['peak_rss_mb'].items()):
+            self.stdout.write(f"{pid:>24}: {rss:.0f} MB")
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dementia_chat', '0002_alter_utterance_options'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='utterance',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:03
+
+import uuid
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_sessions(apps, schema_editor):
+    'Backfill a Session row for every session_id already used by utterances'
+    Session = apps.get_model('dementia_chat', 'Session')
+    Utterance = apps.get_model('dementia_chat', 'Utterance')
+    spans = Utterance.objects.values('session_id').annotate(
+        started_at=models.Min('timestamp'), ended_at=models.Max('timestamp'),
+    )
+    sessions = []
+    for span in spans.iterator():
+        try:
+            session_id = uuid.UUID(span['session_id'])
+        except ValueError:
+            continue
+        sessions.append(Session(id=session_id, started_at=span['started_at'], ended_at=span['ended_at']))
+    Session.objects.bulk_create(sessions, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dementia_chat', '0003_alter_utterance_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Session',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='utterance',
+            index=models.Index(fields=['session_id', 'timestamp', 'id'], name='utterance_session_ts_idx'),
+        ),
+        migrations.RunPython(create_sessions, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,20 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
+
+
+class Session(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    started_at = models.DateTimeField(default=timezone.now)
+    ended_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'dementia_chat'
+
+    def __str__(self):
+        return str(self.id)
+
 
 class Utterance(models.Model):
     SPEAKER_CHOICES = [
@@ -8,12 +24,17 @@ class Utterance(models.Model):
     
     speaker = models.CharField(max_length=10, choices=SPEAKER_CHOICES)
     text = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # When the user's transcription was received, or the reply sent; rows are written later in batches
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    # str(Session.id) of the conversation this utterance belongs to
     session_id = models.CharField(max_length=100)
 
     class Meta:
         app_label = 'dementia_chat'
+        indexes = [
+            # One session's transcript in order, and the keyset pagination over (timestamp, id)
+            models.Index(fields=['session_id', 'timestamp', 'id'], name='utterance_session_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.speaker}: {self.text[:50]}..."
-
@@ -1,14 +1,19 @@
 import sys
 import keyboard
 import re
-import azure.cognitiveservices.speech as speechsdk
-import csv
+import threading
 import time
 import datetime
 
 
 import config as cf
 import dementia_chat.services.tts as tts
+from dementia_chat.services.prompt import STOP_SEQUENCES, ConversationHistory
+from dementia_chat.services.transcript import transcript
+from dementia_chat.services.voice_pipeline import ConversationPipeline
+
+# Azure Speech SDK, or the scripted stand-in with SPEECH_SDK=fake
+speechsdk = cf.speechsdk
 
 # set API keys
 speech_key, service_region = cf.speech_key, cf.service_region
@@ -19,16 +24,13 @@ audio_config = cf.audio_config
 logger = cf.logging.getLogger("__asr__")
 
 
-def record_chat():
-    mode = "w" if cf.script_check == 1 else "a"
-    with open(cf.script_path, encoding="utf-8-sig", newline='', mode=mode) as f:
-        writer = csv.writer(f)
-        cf.chat_history.sort(key=lambda x: x['Time'])
-
-        if cf.script_check == 1:
-            writer.writerow(['Speaker', 'Utt', 'Time'])
-        writer.writerow(cf.chat_history[-1].values())
-    cf.script_check += 1
+def append_chat(speaker, utt):
+    'Add one utterance, stamped with the time since start, to the transcript file'
+    utt_start_time = round(time.time() - cf.game_start_time, 5)
+    start_time = str(datetime.timedelta(seconds=utt_start_time)).split(".")[0]
+    if speaker == 'User':
+        utt = re.sub(r'[^a-zA-Z ]', '', utt).lower()
+    transcript.append(speaker, utt, start_time)
 
 
 # ASR function starts
@@ -36,11 +38,24 @@ class listen_micr:
 
     def __init__(self):
         self._running = True
+        self.pipeline = None
+        # What the LLM sees of the conversation, trimmed to fit its context; the transcript file keeps all of it.
+        # The pipeline's LLM and speech threads both add to it.
+        self.history = ConversationHistory(
+            lambda text: cf.llm.count_tokens(text), cf.n_ctx - cf.max_new_tokens, cf.history_turns
+        )
+        self._history_lock = threading.Lock()
 
     def terminate(self):
         self._running = False
+        if self.pipeline is not None:
+            self.pipeline.stop()
 
     def run(self):
+        # Every conversation gets its own transcript file
+        transcript.rotate()
+        if cf.asr_pipelined:
+            return self.run_pipelined()
         # Set up recognizer (Using MS Azure)
         # Sample codes could be checked
         # https://github.com/Azure-Samples/cognitive-services-speech-sdk/blob/master/quickstart/python/from-microphone/quickstart.py
@@ -63,20 +78,13 @@ class listen_micr:
                 user_utt = result.text[:-1].lower()
                 
                 if user_utt:
-                    utt_start_time = round(time.time() - cf.game_start_time,5)
-                    
                     # print the result to see how the recognizer recognizes
                     print("Recognized: {}".format(user_utt))
                     logger.info('user said: ' + user_utt)
-                    self.respond_to_user_utt(user_utt, cf.chat_history)
 
-                    user_utt = re.sub(r'[^a-zA-Z ]', '', user_utt).lower()
-                    start_time = str(datetime.timedelta(seconds=utt_start_time)).split(".")[0]
-                    
-                    one_turn_history = {'Speaker': 'User', 'Utt': user_utt, 'Time': start_time}
-                    cf.chat_history.append(one_turn_history)
-
-                    record_chat()
+                    # The user turn is recorded before the reply, so the transcript stays in time order
+                    append_chat('User', user_utt)
+                    self.respond_to_user_utt(user_utt)
 
                 # Force to shut down ASR only
                 # pressing ctrl + z shut down ASR
@@ -96,27 +104,46 @@ class listen_micr:
                     logger.info("Error details: {}".format(cancellation_details.error_details))
                 pass
 
+    def run_pipelined(self):
+        # Recognition keeps running while the reply to the last utterance is generated and spoken
+        self.pipeline = ConversationPipeline(
+            speechsdk, speech_config, audio_config, self.generate_reply, on_utterance=self.on_utterance,
+            language=cf.THIS_LANGUAGE,
+        )
+        print("Say Something!")
+        self.pipeline.run()
+        transcript.flush()
+        logger.info(f"Pipeline stopped, user spoke over {self.pipeline.overlaps} replies")
+
+    def on_utterance(self, speaker, utt):
+        'Pipeline callback: every utterance goes to the transcript, and replies to the history once spoken'
+        append_chat(speaker, utt)
+        if speaker == 'System':
+            self.add_reply(utt)
+
+    def add_reply(self, system_utt):
+        with self._history_lock:
+            self.history.append('System', system_utt)
+
+    def generate_reply(self, user_utt):
+        '''
+        LLM reply to user_utt. The user turn joins the prompt history at once; the reply only when it is spoken,
+        as the pipeline drops replies made stale by a newer utterance
+        '''
+        with self._history_lock:
+            input_text = self.history.prompt(cf.prompt, user_utt)
+            self.history.append('User', user_utt)
+        logger.info("history: " + str(self.history.turns))
+        logger.info("input_text: " + input_text)
+
+        return cf.llm.complete(input_text, max_tokens=cf.max_new_tokens, stop=STOP_SEQUENCES).strip()
+
     # Response selection based on the ASR result
-    def respond_to_user_utt(self, user_utt, chat_history):
+    def respond_to_user_utt(self, user_utt):
         try:
-            history = []
-            for i in range(max(0, len(chat_history) - 6), len(chat_history)):
-                history.append(chat_history[i])
-
-            logger.info("history: " + str(history))
-            input_text = f"<|system|>\n{cf.prompt}<|end|>"
-            for turn in history:
-                if turn['Speaker'] == 'User':
-                    input_text += f"\n<|user|>\n{turn['Utt']}<|end|>"
-                else:
-                    input_text += f"\n<|assistant|>\n{turn['Utt']}<|end|>"
-            input_text += f"\n<|user|>\n{user_utt}<|end|>\n<|assistant|>\n"
-            logger.info("input_text: " + input_text)
-            
-            output = cf.llm(input_text, max_tokens=cf.max_length, stop=["<|end|>", ".", "?"], echo=True)
-
-            system_utt = (output['choices'][0]['text'].split("<|assistant|>")[-1]).strip()
+            system_utt = self.generate_reply(user_utt)
             tts.synthesize_utt(system_utt)
+            self.add_reply(system_utt)
         # If error occurs, write down the error at the logs/dm.log file
         except Exception as err:
             logger.error("user input parsing failed " + str(err))
\ No newline at end of file
@@ -0,0 +1,59 @@
+'''
+Per-session ring buffer of openSMILE low-level descriptor frames.
+
+Audio arrives in chunks shorter than the 5 s window the biomarker models were trained on, so features are
+extracted for each new chunk only and accumulated here until a full window is available. After that a new,
+overlapping window is emitted every 'hop_frames' frames. Memory stays fixed at two windows per session.
+'''
+import numpy as np
+
+
+class FrameRingBuffer:
+
+    def __init__(self, window_frames, hop_frames, n_features, dtype=np.float32):
+        if not 0 < hop_frames <= window_frames:
+            raise ValueError(f"hop_frames must be in (0, {window_frames}], got {hop_frames}")
+        self.window_frames = window_frames
+        self.hop_frames = hop_frames
+        # Every frame is written twice, at i and i + window_frames, so the latest window is always
+        # one contiguous slice of the buffer
+        self._buffer = np.zeros((2 * window_frames, n_features), dtype=dtype)
+        self._pos = 0
+        self._filled = 0
+        self._until_emit = window_frames
+
+    def __len__(self):
+        return self._filled
+
+    def clear(self):
+        self._pos = 0
+        self._filled = 0
+        self._until_emit = self.window_frames
+
+    def _write(self, frames):
+        n = len(frames)
+        idx = (self._pos + np.arange(n)) % self.window_frames
+        self._buffer[idx] = frames
+        self._buffer[idx + self.window_frames] = frames
+        self._pos = (self._pos + n) % self.window_frames
+        self._filled = min(self._filled + n, self.window_frames)
+
+    def latest(self):
+        'Copy of the most recent full window, oldest frame first, or None if not enough frames yet'
+        if self._filled < self.window_frames:
+            return None
+        return self._buffer[self._pos:self._pos + self.window_frames].copy()
+
+    def push(self, frames):
+        'Append LLD frames (n_frames x n_features) and return the list of windows completed by them'
+        windows = []
+        start = 0
+        while start < len(frames):
+            take = min(len(frames) - start, self._until_emit)
+            self._write(frames[start:start + take])
+            start += take
+            self._until_emit -= take
+            if self._until_emit == 0:
+                windows.append(self.latest())
+                self._until_emit = self.hop_frames
+        return windows
@@ -0,0 +1,83 @@
+'''
+Incremental accumulators for the text-based biomarkers.
+
+Fillers are counted once, when an utterance arrives, and kept as running totals, so the periodic anomia score is
+O(1) per session instead of re-scanning the whole utterance history.
+'''
+import re
+from collections import deque
+from time import time
+
+FILLER_PATTERN = re.compile(r'\b(u+h+|a+h+|u+m+|h+m+|h+u+h+|m+h+|h+m+|h+a+h+)\b', re.IGNORECASE)
+
+
+class FillerCounter:
+    '''
+    Filler-word counts since the start of the conversation and over sliding windows (in seconds).
+
+    Each window keeps only the (time, count) events still inside it plus their running sum; expired events are
+    dropped when the window is read, so both adding and reading are amortized O(1).
+    '''
+
+    def __init__(self, windows=(60, 300), start_time=None):
+        self.start_time = time() if start_time is None else start_time
+        self.total = 0
+        self._events = {window: deque() for window in windows}
+        self._sums = {window: 0 for window in windows}
+
+    @property
+    def windows(self):
+        return tuple(self._events)
+
+    def to_dict(self):
+        'JSON-serialisable state, for the shared session store'
+        return {
+            'start_time': self.start_time,
+            'total': self.total,
+            'events': {str(window): [list(event) for event in events] for window, events in self._events.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data, windows):
+        counter = cls(windows, data['start_time'])
+        counter.total = data['total']
+        for window in windows:
+            events = [tuple(event) for event in data['events'].get(str(window), [])]
+            counter._events[window].extend(events)
+            counter._sums[window] = sum(count for _, count in events)
+        return counter
+
+    def add(self, utterance, now=None):
+        'Count the fillers in a new utterance and return how many there were'
+        count = len(FILLER_PATTERN.findall(utterance))
+        if count:
+            now = time() if now is None else now
+            self.total += count
+            for window, events in self._events.items():
+                events.append((now, count))
+                self._sums[window] += count
+        return count
+
+    def count(self, window, now=None):
+        'Fillers in the last window seconds'
+        now = time() if now is None else now
+        events = self._events[window]
+        while events and events[0][0] <= now - window:
+            self._sums[window] -= events.popleft()[1]
+        return self._sums[window]
+
+    def rate(self, window=None, now=None):
+        'Fillers per minute over the last window seconds, or since the start when window is None'
+        now = time() if now is None else now
+        elapsed = now - self.start_time
+        if window is None:
+            count = self.total
+        else:
+            count = self.count(window, now)
+            elapsed = min(elapsed, window)
+        return count / (elapsed / 60) if elapsed > 0 else 0
+
+    def rates(self, now=None):
+        'Fillers per minute for every configured window, keyed by window length in seconds'
+        now = time() if now is None else now
+        return {window: self.rate(window, now) for window in self._events}
@@ -0,0 +1,174 @@
+'''
+Streaming bulk export of utterances as CSV, JSONL or Parquet.
+
+Rows are read through a server-side cursor ('.iterator()') and encoded a chunk at a time, so memory stays flat
+however many utterances are exported. Parquet needs the optional 'pyarrow' package.
+'''
+import csv
+import io
+import json
+from datetime import datetime, time
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+EXPORT_FIELDS = ['id', 'session_id', 'speaker', 'text', 'timestamp']
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Rows per chunk handed to the response / file, and per Parquet row group
+CHUNK_ROWS = 1000
+PARQUET_ROW_GROUP = 50000
+
+
+class ExportError(Exception):
+    """Raised for export requests that cannot be served"""
+
+
+def parse_bound(value):
+    'Parse an ISO date or datetime bound; dates mean midnight in the current time zone'
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(value)
+            parsed = datetime.combine(day, time.min)
+    except ValueError:
+        raise ExportError(f"Invalid date: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def export_rows(start=None, end=None, sessions=None):
+    'Utterance rows (as tuples of EXPORT_FIELDS) in session and time order, fetched via a server-side cursor'
+    utterances = apps.get_model('dementia_chat', 'Utterance').objects.all()
+    if start is not None:
+        utterances = utterances.filter(timestamp__gte=start)
+    if end is not None:
+        utterances = utterances.filter(timestamp__lt=end)
+    if sessions:
+        utterances = utterances.filter(session_id__in=[str(session) for session in sessions])
+    return utterances.order_by('session_id', 'timestamp', 'id').values_list(*EXPORT_FIELDS).iterator(
+        chunk_size=CHUNK_ROWS
+    )
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for chunk in _chunks(rows, CHUNK_ROWS):
+        writer.writerows(row[:-1] + (row[-1].isoformat(),) for row in chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_jsonl(rows):
+    for chunk in _chunks(rows, CHUNK_ROWS):
+        lines = []
+        for pk, session, speaker, text, timestamp in chunk:
+            lines.append(json.dumps({
+                'id': pk, 'session_id': session, 'speaker': speaker, 'text': text, 'timestamp': timestamp.isoformat(),
+            }, ensure_ascii=False))
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class _StreamSink:
+    'Write-only file object that hands out what has been written so far'
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        # Parquet footer offsets rely on the total position, not on what is still buffered
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_parquet(rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('id', pa.int64()), ('session_id', pa.string()), ('speaker', pa.string()),
+        ('text', pa.string()), ('timestamp', pa.timestamp('us', tz='UTC')),
+    ])
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    for chunk in _chunks(rows, PARQUET_ROW_GROUP):
+        writer.write_table(pa.Table.from_pydict(dict(zip(EXPORT_FIELDS, zip(*chunk))), schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+FORMATS = {
+    'csv': iter_csv,
+    'jsonl': iter_jsonl,
+    'parquet': iter_parquet,
+}
+
+
+def export(fmt, start=None, end=None, sessions=None):
+    'Iterator of encoded byte chunks for the selected utterances'
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown export format: {fmt}")
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportError("Parquet export needs the pyarrow package")
+    return FORMATS[fmt](export_rows(start, end, sessions))
+
+
+async def aiter_chunks(chunks):
+    'Pull chunks from a blocking (database) iterator on the sync thread, one at a time'
+    done = object()
+    get_next = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await get_next(chunks, done)
+        if chunk is done:
+            return
+        yield chunk
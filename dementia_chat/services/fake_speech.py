@@ -0,0 +1,194 @@
+'''
+In-process stand-in for 'azure.cognitiveservices.speech', selected with SPEECH_SDK=fake.
+
+Only the parts used by 'asr.py', 'tts.py' and the voice pipeline are implemented. The recognizer "hears" a
+script of (delay in seconds, text) pairs instead of a microphone, and the synthesizer takes 'seconds_per_char'
+per character to "speak" instead of playing audio, so the desktop conversation runs offline and in tests.
+The script is read from the file in FAKE_SPEECH_SCRIPT (one utterance per line, optionally prefixed by a delay
+and a tab) or set on 'SpeechRecognizer.script'.
+'''
+import enum
+import os
+import threading
+
+
+class ResultReason(enum.Enum):
+    RecognizingSpeech = 2
+    RecognizedSpeech = 3
+    NoMatch = 0
+    Canceled = 1
+    SynthesizingAudioCompleted = 10
+
+
+class CancellationReason(enum.Enum):
+    Error = 1
+    EndOfStream = 2
+    CancelledByUser = 3
+
+
+class CancellationDetails:
+
+    def __init__(self, reason, error_details=''):
+        self.reason = reason
+        self.error_details = error_details
+
+
+class Result:
+
+    def __init__(self, reason, text='', cancellation_details=None):
+        self.reason = reason
+        self.text = text
+        self.cancellation_details = cancellation_details
+        self.no_match_details = None
+
+
+class EventArgs:
+
+    def __init__(self, result=None, cancellation_details=None):
+        self.result = result
+        self.cancellation_details = cancellation_details
+
+
+class EventSignal:
+
+    def __init__(self):
+        self._callbacks = []
+
+    def connect(self, callback):
+        self._callbacks.append(callback)
+
+    def disconnect_all(self):
+        self._callbacks = []
+
+    def fire(self, event):
+        for callback in list(self._callbacks):
+            callback(event)
+
+
+class ResultFuture:
+    'Runs fn on its own thread, like the SDK\'s async calls'
+
+    def __init__(self, fn, *args):
+        self._result = None
+        self._thread = threading.Thread(target=self._run, args=(fn,) + args, daemon=True)
+        self._thread.start()
+
+    def _run(self, fn, *args):
+        self._result = fn(*args)
+
+    def get(self):
+        self._thread.join()
+        return self._result
+
+
+class SpeechConfig:
+
+    def __init__(self, subscription=None, region=None):
+        self.subscription = subscription
+        self.region = region
+        self.speech_synthesis_voice_name = None
+        self.speech_recognition_language = None
+
+
+class audio:
+
+    class AudioConfig:
+
+        def __init__(self, device_name=None, use_default_microphone=False):
+            self.device_name = device_name
+            self.use_default_microphone = use_default_microphone
+
+
+def load_script(path):
+    'Script lines "text" or "delay<TAB>text" as (delay, text) pairs; the default delay is one second'
+    script = []
+    with open(path, encoding='utf-8') as lines:
+        for line in lines:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            delay, _, text = line.rpartition('\t')
+            script.append((float(delay) if delay else 1.0, text))
+    return script
+
+
+class SpeechRecognizer:
+
+    script = load_script(os.environ['FAKE_SPEECH_SCRIPT']) if os.getenv('FAKE_SPEECH_SCRIPT') else []
+
+    def __init__(self, speech_config=None, language=None, audio_config=None, script=None):
+        self.language = language
+        self._script = list(self.script if script is None else script)
+        self._stop = threading.Event()
+        self._thread = None
+        self.recognizing = EventSignal()
+        self.recognized = EventSignal()
+        self.canceled = EventSignal()
+        self.session_started = EventSignal()
+        self.session_stopped = EventSignal()
+
+    def _hear(self):
+        'Wait for the next scripted utterance; None once the script has run out or recognition stopped'
+        if not self._script:
+            return None
+        delay, text = self._script.pop(0)
+        # Partial results arrive halfway through the utterance, as they would from the service
+        if self._stop.wait(delay / 2):
+            return None
+        self.recognizing.fire(EventArgs(Result(ResultReason.RecognizingSpeech, text)))
+        if self._stop.wait(delay / 2):
+            return None
+        return text
+
+    def _recognize_continuously(self):
+        self.session_started.fire(EventArgs())
+        while not self._stop.is_set():
+            text = self._hear()
+            if text is None:
+                break
+            self.recognized.fire(EventArgs(Result(ResultReason.RecognizedSpeech, text)))
+        if not self._stop.is_set():
+            details = CancellationDetails(CancellationReason.EndOfStream)
+            self.canceled.fire(EventArgs(Result(ResultReason.Canceled, cancellation_details=details), details))
+        self.session_stopped.fire(EventArgs())
+
+    def start_continuous_recognition_async(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._recognize_continuously, name='fake-recognizer', daemon=True)
+        self._thread.start()
+        return ResultFuture(lambda: None)
+
+    def stop_continuous_recognition_async(self):
+        self._stop.set()
+        thread = self._thread
+        return ResultFuture(lambda: thread.join() if thread and thread is not threading.current_thread() else None)
+
+    def recognize_once_async(self):
+        def recognize():
+            text = self._hear()
+            if text is None:
+                return Result(ResultReason.NoMatch)
+            return Result(ResultReason.RecognizedSpeech, text)
+        return ResultFuture(recognize)
+
+
+class SpeechSynthesizer:
+
+    def __init__(self, speech_config=None, audio_config=None, seconds_per_char=0.01):
+        self.seconds_per_char = seconds_per_char
+        self.spoken = []
+        self._stop = threading.Event()
+
+    def speak_text_async(self, text):
+        def speak():
+            self._stop.clear()
+            if self._stop.wait(len(text) * self.seconds_per_char):
+                details = CancellationDetails(CancellationReason.CancelledByUser)
+                return Result(ResultReason.Canceled, text, cancellation_details=details)
+            self.spoken.append(text)
+            return Result(ResultReason.SynthesizingAudioCompleted, text)
+        return ResultFuture(speak)
+
+    def stop_speaking_async(self):
+        self._stop.set()
+        return ResultFuture(lambda: None)
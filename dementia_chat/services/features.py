@@ -0,0 +1,227 @@
+'''
+openSMILE feature extraction on a pool of worker processes.
+
+Extraction holds the GIL for the whole chunk, so it runs in separate processes that each own an
+'opensmile.Smile' instance. Every session feeds its chunks through a 'SessionExtractor', which keeps at most
+'max_pending' chunks waiting and drops the oldest one when the session falls behind.
+
+Only the 28 LLDs used by the biomarker models are kept. They are taken by index from the raw
+(channels, features, frames) array instead of selecting columns of the full DataFrame. 'biomarker_lld.conf' is
+ComParE_2016 cut down to the components those LLDs need (no deltas, functionals or unused spectral
+descriptors), which gives the same frames with less work. With 'verify' on, every chunk is also run through
+the full ComParE_2016 set and the frames are checked to be identical.
+
+This module is imported by the worker processes, so it must not import the app config (and with it the LLM).
+'''
+import asyncio
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+
+import numpy as np
+import opensmile
+
+from .metrics import DROPPED, observe
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000  # Hz
+
+PROSODY_FEATURES = [
+    'F0final_sma', 'voicingFinalUnclipped_sma',
+    'audspec_lengthL1norm_sma', 'audspecRasta_lengthL1norm_sma',
+    'pcm_RMSenergy_sma', 'pcm_zcr_sma', 'jitterLocal_sma',
+    'jitterDDP_sma', 'shimmerLocal_sma', 'logHNR_sma'
+]
+
+PRONUNCIATION_FEATURES = [
+    'audSpec_Rfilt_sma[3]', 'audSpec_Rfilt_sma[5]', 'audSpec_Rfilt_sma[9]', 'audSpec_Rfilt_sma[11]',
+    'audSpec_Rfilt_sma[12]', 'audSpec_Rfilt_sma[16]', 'audSpec_Rfilt_sma[20]', 'audSpec_Rfilt_sma[21]',
+    'audSpec_Rfilt_sma[23]', 'audSpec_Rfilt_sma[24]', 'audSpec_Rfilt_sma[25]', 'pcm_fftMag_fband250-650_sma',
+    'pcm_fftMag_spectralCentroid_sma', 'pcm_fftMag_spectralVariance_sma', 'mfcc_sma[5]', 'mfcc_sma[9]', 'mfcc_sma[10]',
+    'mfcc_sma[13]'
+    ]
+
+# Both feature sets share one frame array, prosody columns first
+BIOMARKER_FEATURES = PROSODY_FEATURES + PRONUNCIATION_FEATURES
+
+# One extractor per worker process, created by the pool initializer
+_smile = None
+_feature_index = None
+_reference = None
+_verify = False
+
+
+def pcm_to_float(samples):
+    'Convert int16 PCM to float32 in [-1, 1], peak-normalized'
+    audio = samples.astype(np.float32)
+    peak = np.max(np.abs(audio)) if audio.size else 0
+    if peak > 0:
+        audio /= peak
+    return audio
+
+
+def full_smile():
+    return opensmile.Smile(
+        feature_set=opensmile.FeatureSet.ComParE_2016,
+        feature_level=opensmile.FeatureLevel.LowLevelDescriptors,
+        sampling_rate=SAMPLE_RATE,
+    )
+
+
+def init_worker(config=None, level='lld', verify=False):
+    'Create this process\'s extractor; config is an optional reduced openSMILE config file'
+    global _smile, _feature_index, _reference, _verify
+    if config:
+        _smile = opensmile.Smile(feature_set=config, feature_level=level, sampling_rate=SAMPLE_RATE)
+    else:
+        _smile = full_smile()
+
+    names = list(_smile.feature_names)
+    missing = [name for name in BIOMARKER_FEATURES if name not in names]
+    if missing:
+        raise ValueError(f"openSMILE config does not produce {missing}")
+    _feature_index = np.array([names.index(name) for name in BIOMARKER_FEATURES])
+
+    if verify and not config:
+        logger.warning("LLD verification needs a reduced openSMILE config to compare with ComParE_2016, disabled")
+    _verify = bool(verify and config)
+    _reference = full_smile() if _verify else None
+
+
+def extract_full(signal, sample_rate):
+    'Previous extraction path: full ComParE_2016 DataFrame, then column selection'
+    smile = _reference if _reference is not None else _smile
+    features = smile.process_signal(signal, sample_rate)
+    return features[BIOMARKER_FEATURES].to_numpy(dtype=np.float32)
+
+
+def extract_frames(samples, sample_rate):
+    'Worker entry point: int16 PCM in, LLD frames (n_frames x BIOMARKER_FEATURES) out'
+    if _smile is None:
+        init_worker()
+    signal = pcm_to_float(samples)
+
+    # Calling the extractor directly returns (channels, features, frames) without building a DataFrame
+    values = _smile(signal, sample_rate)
+    frames = np.ascontiguousarray(values[0, _feature_index, :].T, dtype=np.float32)
+
+    if _verify:
+        reference = extract_full(signal, sample_rate)
+        if reference.shape != frames.shape or not np.array_equal(reference, frames, equal_nan=True):
+            logger.error(f"Reduced LLD extraction differs from ComParE_2016: {frames.shape} vs {reference.shape}")
+            return reference
+    return frames
+
+
+def extract_frames_timed(samples, sample_rate):
+    'extract_frames and the seconds it took in the worker, without the time spent queued for one'
+    start = perf_counter()
+    frames = extract_frames(samples, sample_rate)
+    return frames, perf_counter() - start
+
+
+class FeatureExtractionPool:
+
+    def __init__(self, max_workers, config=None, level='lld', verify=False):
+        # max_workers=0 extracts on a thread of this process instead, e.g. for development
+        self.max_workers = max_workers
+        self.initargs = (config, level, verify)
+        self._executor = None
+        self._pending = 0
+
+    @property
+    def depth(self):
+        'Chunks queued or being extracted'
+        return self._pending
+
+    def _get_executor(self):
+        if self.max_workers == 0:
+            if _smile is None:
+                init_worker(*self.initargs)
+            return None
+        if self._executor is None:
+            # spawn rather than fork: the parent runs llama-cpp and asyncio threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=self.initargs,
+            )
+        return self._executor
+
+    async def extract(self, samples, sample_rate):
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        start = perf_counter()
+        try:
+            frames, seconds = await loop.run_in_executor(
+                self._get_executor(), extract_frames_timed, samples, sample_rate
+            )
+            # Extraction proper, and the wait for a free worker plus the transfer to and from it
+            observe('opensmile', seconds, samples.size)
+            observe('opensmile_queue', perf_counter() - start - seconds)
+            return frames
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for the next chunk
+            logger.error("Feature extraction pool broken, restarting it")
+            self._executor = None
+            raise
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class SessionExtractor:
+    '''
+    Runs one session's chunks through the pool in order and hands the frames to on_frames.
+
+    At most one chunk per session is in flight; if more than max_pending are waiting, the oldest is dropped
+    so a slow session never falls further and further behind real time.
+    '''
+
+    def __init__(self, pool, on_frames, max_pending=2):
+        self.pool = pool
+        self.on_frames = on_frames
+        self.dropped = 0
+        self._pending = deque(maxlen=max_pending)
+        self._task = None
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    @property
+    def idle(self):
+        return not self._pending and (self._task is None or self._task.done())
+
+    def submit(self, samples, sample_rate):
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+            DROPPED.labels('audio_chunk').inc()
+            logger.warning(f"Feature extraction behind, dropped oldest chunk ({self.dropped} so far)")
+        self._pending.append((samples, sample_rate))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self._pending:
+            samples, sample_rate = self._pending.popleft()
+            try:
+                frames = await self.pool.extract(samples, sample_rate)
+            except Exception as e:
+                logger.error(f"Error extracting features: {e}")
+                continue
+            await self.on_frames(frames)
+
+    def close(self):
+        self._pending.clear()
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,96 @@
+'''
+Random forests compiled to flat NumPy node arrays.
+
+All trees of a fitted sklearn RandomForestClassifier are concatenated into one set of node arrays (feature,
+threshold, children, leaf probabilities) and evaluated for every tree and row at once, one tree level per
+step. The result matches 'predict_proba' and loads from a small .npz instead of unpickling the estimator.
+'''
+import numpy as np
+
+
+class CompiledForest:
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth, classes, n_features_in=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        # Trees need not split on the last columns, so the width comes from the estimator; files compiled
+        # before it was stored fall back to the highest feature used
+        if n_features_in is None:
+            n_features_in = int(feature.max()) + 1 if feature.size else 0
+        self.n_features_in_ = int(n_features_in)
+
+    @classmethod
+    def from_estimator(cls, forest):
+        'Compile a fitted RandomForestClassifier (single output)'
+        if getattr(forest, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output forests can be compiled")
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n = tree.node_count
+            is_leaf = tree.children_left < 0
+            own = np.arange(offset, offset + n)
+
+            # Leaves point at themselves, so extra steps for shallow branches are no-ops
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, own, tree.children_left + offset))
+            rights.append(np.where(is_leaf, own, tree.children_right + offset))
+
+            # Normalised class distribution per node, as in DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :forest.n_classes_].astype(np.float64)
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(value / normalizer)
+
+            roots.append(offset)
+            offset += n
+
+        return cls(
+            feature=np.concatenate(features).astype(np.int32),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(np.int32),
+            right=np.concatenate(rights).astype(np.int32),
+            value=np.concatenate(values),
+            roots=np.array(roots, dtype=np.int32),
+            max_depth=max(estimator.tree_.max_depth for estimator in forest.estimators_),
+            classes=np.asarray(forest.classes_),
+            n_features_in=forest.n_features_in_,
+        )
+
+    def save(self, path):
+        np.savez(
+            path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+            value=self.value, roots=self.roots, max_depth=self.max_depth, classes=self.classes_,
+            n_features_in=self.n_features_in_,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    def apply(self, X):
+        'Leaf index reached in every tree, shape (n_samples, n_trees)'
+        # sklearn evaluates trees on float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        node = np.broadcast_to(self.roots, (X.shape[0], self.roots.size))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def predict_proba(self, X):
+        return self.value[self.apply(X)].mean(axis=1)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
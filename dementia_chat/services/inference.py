@@ -0,0 +1,155 @@
+'''
+Bounded worker pool that runs LLM inference off the event loop.
+
+Requests beyond 'llm_queue_size' are refused straight away instead of piling up behind a slow turn,
+and every request carries a deadline so a patient never waits on a reply that is no longer useful.
+'''
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+from .. import config as cf
+from .metrics import track_queue
+from .llm import estimate_tokens
+from .prompt import STOP_SEQUENCES
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBusy(Exception):
+    """Raised when the inference queue is full"""
+
+
+class InferenceTimeout(InferenceBusy):
+    """Raised when a request misses its deadline"""
+
+
+class InferenceExecutor:
+
+    def __init__(self, max_workers=1, max_queue=8, timeout=30.0):
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def depth(self):
+        'Number of requests queued or running'
+        return self._pending
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def _call(self, deadline, fn, args, kwargs):
+        # Skip work whose caller has already given up while it sat in the queue
+        if monotonic() > deadline:
+            raise InferenceTimeout("Inference request expired in the queue")
+        return fn(*args, **kwargs)
+
+    def _submit(self, fn, args, kwargs, deadline):
+        with self._lock:
+            if self._pending >= self.max_queue:
+                raise InferenceBusy(f"Inference queue full ({self._pending} pending)")
+            self._pending += 1
+
+        try:
+            future = self._executor.submit(self._call, deadline, fn, args, kwargs)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def stream(self, fn, *args, timeout=None, **kwargs):
+        'Iterate fn(*args, **kwargs) on the pool, yielding each item as soon as it is produced'
+        timeout = self.timeout if timeout is None else timeout
+        deadline = monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def produce(*args, **kwargs):
+            items = fn(*args, **kwargs)
+            try:
+                for item in items:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                # Run the generator's cleanup (e.g. saving the llama state) here, not whenever it is collected
+                close = getattr(items, 'close', None)
+                if close is not None:
+                    close()
+
+        def finished(future):
+            # Also fires when the request expired in the queue and produce() never ran
+            if not future.cancelled() and future.exception() is not None:
+                loop.call_soon_threadsafe(queue.put_nowait, future.exception())
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        future = self._submit(produce, args, kwargs, deadline)
+        future.add_done_callback(finished)
+        try:
+            while True:
+                item = await asyncio.wait_for(queue.get(), max(deadline - monotonic(), 0))
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        except asyncio.TimeoutError:
+            logger.warning(f"Inference stream timed out after {timeout}s (queue depth: {self._pending})")
+            raise InferenceTimeout(f"Inference stream timed out after {timeout}s")
+        finally:
+            # Stops the producer at its next item and drops the request if it has not started
+            stop.set()
+            future.cancel()
+
+
+executor = InferenceExecutor(
+    max_workers=cf.llm_workers,
+    max_queue=cf.llm_queue_size,
+    timeout=cf.llm_timeout,
+)
+
+track_queue('llm', lambda: executor.depth)
+
+
+
+# The backend is looked up on the inference thread, so loading it never blocks the event loop
+def _stream(prompt, **kwargs):
+    return cf.llm.stream(prompt, **kwargs)
+
+
+def count_tokens(text):
+    'Tokens of text with the loaded backend, or an estimate while it is still loading (or runs elsewhere)'
+    return cf.llm.count_tokens(text) if cf.is_loaded('llm') else estimate_tokens(text)
+
+
+def forget_session(session_id):
+    'Drop the cached state of a finished session, without loading the backend just for that'
+    if cf.is_loaded('llm'):
+        cf.llm.forget(session_id)
+
+
+async def generate_reply(session_id, input_text, on_delta=None):
+    '''
+    Generate the assistant reply to a prompt; with on_delta, tokens are streamed to await on_delta(text).
+
+    The backend is always streamed, so cancelling the awaiting task stops generation at the next token.
+    '''
+    kwargs = dict(session_id=session_id, max_tokens=cf.max_new_tokens, stop=STOP_SEQUENCES)
+    parts = []
+    async for delta in executor.stream(_stream, input_text, **kwargs):
+        if delta:
+            parts.append(delta)
+            if on_delta is not None:
+                await on_delta(delta)
+    return ''.join(parts).strip()
@@ -0,0 +1,268 @@
+'''
+LLM backends behind one blocking interface, selected with LLM_BACKEND.
+
+- 'llama_cpp': the GGUF model in this process, with a per-session KV state cache
+- 'server': an out-of-process llama.cpp server ('llama-server') over HTTP
+- 'stub': deterministic canned replies with configurable latency, for load tests and development
+
+Every backend has 'complete(prompt, ...)', returning the reply text, and 'stream(prompt, ...)', yielding text
+deltas. Both block, so they are run on the inference executor. 'concurrency' is how many calls may run at once,
+and 'count_tokens(text)' sizes prompts against the context window.
+'''
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+import zlib
+from collections import OrderedDict
+from time import perf_counter
+
+from .metrics import observe_llm
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text):
+    'Upper-end token estimate (about 3 bytes per token) for backends without a local tokenizer'
+    return max(1, (len(text.encode('utf-8')) + 2) // 3)
+
+
+class SessionStateCache:
+    '''
+    LRU of saved llama-cpp states keyed by session id.
+
+    Each state holds the session's KV cache (tens of MB at n_ctx=256), so only the most recently active
+    'max_sessions' are kept in memory. Must be used from the inference thread that owns the model.
+    '''
+
+    def __init__(self, max_sessions=4):
+        self.max_sessions = max_sessions
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._states.pop(session_id, None)
+
+    def restore(self, llm, session_id, tokens):
+        'Load the session state if it shares a longer prefix with the prompt tokens than the current model state'
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is not None:
+                self._states.move_to_end(session_id)
+        if state is None:
+            return
+
+        current = llm.input_ids[:llm.n_tokens].tolist()
+        # input_ids is the whole n_ctx buffer; only the first n_tokens were evaluated
+        cached = state.input_ids[:state.n_tokens].tolist()
+        if llm.longest_token_prefix(cached, tokens) > llm.longest_token_prefix(current, tokens):
+            llm.load_state(state)
+
+    def save(self, llm, session_id):
+        state = llm.save_state()
+        with self._lock:
+            self._states[session_id] = state
+            self._states.move_to_end(session_id)
+            while len(self._states) > self.max_sessions:
+                evicted, _ = self._states.popitem(last=False)
+                logger.debug(f"Evicted llama state for session {evicted}")
+
+    def generate(self, llm, session_id, prompt, stream=False, **kwargs):
+        'Call llm(prompt, **kwargs) with the session state restored first and saved afterwards'
+        tokens = llm.tokenize(prompt.encode('utf-8'), special=True)
+        self.restore(llm, session_id, tokens)
+        # Only the tokens after the prefix already in the KV cache are evaluated (at least the last one)
+        evaluated = max(len(tokens) - llm.longest_token_prefix(llm.input_ids[:llm.n_tokens].tolist(), tokens), 1)
+        if not stream:
+            start = perf_counter()
+            output = llm(prompt, **kwargs)
+            # Prompt evaluation and generation cannot be told apart without streaming
+            observe_llm('turn', evaluated + output['usage']['completion_tokens'], perf_counter() - start)
+            self.save(llm, session_id)
+            return output
+
+        def chunks():
+            start = perf_counter()
+            first = None
+            generated = 0
+            try:
+                for chunk in llm(prompt, stream=True, **kwargs):
+                    if first is None:
+                        # The first token comes out once the prompt has been evaluated
+                        first = perf_counter()
+                        observe_llm('prompt_eval', evaluated, first - start)
+                    else:
+                        generated += 1
+                    yield chunk
+            finally:
+                if first is not None:
+                    observe_llm('generation', generated, perf_counter() - first)
+                self.save(llm, session_id)
+        return chunks()
+
+
+class LlamaCppBackend:
+
+    # A Llama instance is not thread-safe
+    concurrency = 1
+
+    def __init__(self, model_path, n_ctx=256, n_threads=16, n_gpu_layers=0, session_states=4):
+        from llama_cpp import Llama
+
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, n_gpu_layers=n_gpu_layers)
+        # Saved llama states so each turn only evaluates the new tokens
+        self.states = SessionStateCache(max_sessions=session_states)
+
+    def _generate(self, prompt, session_id, stream, **kwargs):
+        if session_id is None:
+            return self.llm(prompt, stream=stream, **kwargs)
+        return self.states.generate(self.llm, session_id, prompt, stream=stream, **kwargs)
+
+    def complete(self, prompt, session_id=None, max_tokens=256, stop=None):
+        output = self._generate(prompt, session_id, False, max_tokens=max_tokens, stop=stop)
+        return output['choices'][0]['text']
+
+    def stream(self, prompt, session_id=None, max_tokens=256, stop=None):
+        for chunk in self._generate(prompt, session_id, True, max_tokens=max_tokens, stop=stop):
+            yield chunk['choices'][0]['text']
+
+    def count_tokens(self, text):
+        # Tokenizing only reads the vocabulary, so it is safe next to a running generation
+        return len(self.llm.tokenize(text.encode('utf-8'), add_bos=False, special=True))
+
+    def forget(self, session_id):
+        self.states.discard(session_id)
+
+
+class LlamaServerBackend:
+    '''
+    Completions from a llama.cpp server's /completion endpoint.
+
+    The server keeps the KV cache of each of its slots ('cache_prompt'), so no state is held here, and it
+    serves 'parallel' requests at once.
+    '''
+
+    def __init__(self, url, timeout=30.0, parallel=1):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.concurrency = parallel
+
+    def _request(self, prompt, max_tokens, stop, stream):
+        payload = {
+            'prompt': prompt,
+            'n_predict': max_tokens,
+            'stop': stop or [],
+            'stream': stream,
+            'cache_prompt': True,
+        }
+        request = urllib.request.Request(
+            self.url + '/completion', data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+        )
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _observe(self, timings):
+        # The server reports its own prompt evaluation and generation timings
+        if timings:
+            observe_llm('prompt_eval', timings['prompt_n'], timings['prompt_ms'] / 1000)
+            observe_llm('generation', timings['predicted_n'], timings['predicted_ms'] / 1000)
+
+    def complete(self, prompt, session_id=None, max_tokens=256, stop=None):
+        with self._request(prompt, max_tokens, stop, False) as response:
+            result = json.load(response)
+        self._observe(result.get('timings'))
+        return result['content']
+
+    def stream(self, prompt, session_id=None, max_tokens=256, stop=None):
+        with self._request(prompt, max_tokens, stop, True) as response:
+            # Server-sent events, one JSON object per 'data:' line
+            for line in response:
+                if not line.startswith(b'data: '):
+                    continue
+                event = json.loads(line[len(b'data: '):])
+                if event.get('content'):
+                    yield event['content']
+                if event.get('stop'):
+                    self._observe(event.get('timings'))
+                    return
+
+    def count_tokens(self, text):
+        return estimate_tokens(text)
+
+    def forget(self, session_id):
+        pass
+
+
+class StubBackend:
+    '''
+    Canned replies chosen by a hash of the prompt, so the same conversation always gets the same answers.
+
+    Waits 'latency' seconds before the first token and 'token_latency' between tokens (one word each),
+    without holding the GIL, so the rest of the pipeline can be exercised at full concurrency.
+    '''
+
+    REPLIES = [
+        "That sounds lovely, tell me more about it",
+        "I understand, take your time",
+        "What did you have for breakfast today",
+        "It is nice to talk with you again",
+        "Do you remember where you put it",
+        "That must have been a happy time",
+    ]
+
+    def __init__(self, latency=0.2, token_latency=0.02, concurrency=64):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.concurrency = concurrency
+
+    def reply(self, prompt, max_tokens=256, stop=None):
+        'Tokens of the reply to prompt, cut at max_tokens and at the first stop sequence'
+        text = self.REPLIES[zlib.crc32(prompt.encode('utf-8')) % len(self.REPLIES)]
+        for sequence in stop or []:
+            text = text.split(sequence, 1)[0]
+        words = text.split(' ')[:max(max_tokens, 0)]
+        if not words:
+            return []
+        return [words[0]] + [' ' + word for word in words[1:]]
+
+    def complete(self, prompt, session_id=None, max_tokens=256, stop=None):
+        return ''.join(self.stream(prompt, session_id, max_tokens, stop))
+
+    def stream(self, prompt, session_id=None, max_tokens=256, stop=None):
+        tokens = self.reply(prompt, max_tokens, stop)
+        time.sleep(self.latency)
+        observe_llm('prompt_eval', len(prompt.split()), self.latency)
+        start = perf_counter()
+        for token in tokens:
+            yield token
+            time.sleep(self.token_latency)
+        observe_llm('generation', len(tokens), perf_counter() - start)
+
+    def count_tokens(self, text):
+        return estimate_tokens(text)
+
+    def forget(self, session_id):
+        pass
+
+
+BACKENDS = {
+    'llama_cpp': LlamaCppBackend,
+    'server': LlamaServerBackend,
+    'stub': StubBackend,
+}
+
+
+def create_backend(name, **options):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend: {name} (expected one of {', '.join(BACKENDS)})")
+    backend = BACKENDS[name](**options)
+    logger.info(f"LLM backend: {name}")
+    return backend
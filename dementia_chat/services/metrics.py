@@ -0,0 +1,102 @@
+'''
+Prometheus metrics for the conversation pipeline.
+
+Every stage of a turn is timed into one histogram labelled by stage; queue depths, the number of active
+sessions and the load time and memory of every loaded biomarker model are gauges read at scrape time. They are
+served in the Prometheus text format at /metrics. Each process (front-end or worker) keeps its own numbers.
+
+Must not import the app config: it is also imported by the feature extraction module.
+'''
+import os
+from contextlib import contextmanager
+from time import perf_counter
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+STAGE_SECONDS = Histogram(
+    'dementia_chat_stage_seconds', 'Time spent in each stage of the conversation pipeline', ['stage'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30),
+)
+STAGE_ITEMS = Counter(
+    'dementia_chat_stage_items_total', 'Items handled by each stage (audio samples, windows, utterances, tokens)',
+    ['stage'],
+)
+LLM_TOKENS = Counter('dementia_chat_llm_tokens_total', 'Tokens evaluated by the LLM', ['phase'])
+LLM_TOKENS_PER_SECOND = Histogram(
+    'dementia_chat_llm_tokens_per_second', 'LLM throughput per turn', ['phase'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000),
+)
+DROPPED = Counter('dementia_chat_dropped_total', 'Work refused or dropped under load', ['what'])
+ACTIVE_SESSIONS = Gauge('dementia_chat_active_sessions', 'Open WebSocket sessions in this process')
+QUEUE_DEPTH = Gauge('dementia_chat_queue_depth', 'Items queued or running in each in-process queue', ['queue'])
+RESPONSE_CACHE = Counter('dementia_chat_response_cache_total', 'Response cache lookups by result', ['result'])
+RESPONSE_CACHE_ENTRIES = Gauge('dementia_chat_response_cache_entries', 'Replies held in the response cache')
+
+
+# ModelRegistry.stats() keys exported per model, with their help text
+MODEL_STATS = {
+    'load_seconds': 'Seconds the current version of each model took to load',
+    'memory_bytes': 'Resident memory added by loading each model',
+    'file_bytes': 'Size of each model file on disk',
+    'loads': 'Times each model has been loaded, including hot reloads',
+    'loaded_at': 'Unix time the current version of each model was loaded',
+}
+
+
+class ModelCollector:
+    'Exposes the model registry\'s stats() as gauges labelled by model file'
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def collect(self):
+        families = {
+            key: GaugeMetricFamily(f'dementia_chat_model_{key}', help_text, labels=['model'])
+            for key, help_text in MODEL_STATS.items()
+        }
+        for path, stats in self.stats().items():
+            for key, family in families.items():
+                if stats.get(key) is not None:
+                    family.add_metric([os.path.basename(path)], stats[key])
+        return list(families.values())
+
+
+def observe(stage, seconds, items=None):
+    'Record seconds (and items handled) for the given stage, for durations measured elsewhere'
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if items:
+        STAGE_ITEMS.labels(stage).inc(items)
+
+
+@contextmanager
+def timed(stage, items=None):
+    'Observe the duration of the block under the given stage'
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, perf_counter() - start, items)
+
+
+def observe_llm(phase, tokens, seconds):
+    'Record one LLM phase of a turn: prompt_eval or generation'
+    STAGE_SECONDS.labels(f'llm_{phase}').observe(seconds)
+    LLM_TOKENS.labels(phase).inc(tokens)
+    if tokens and seconds > 0:
+        LLM_TOKENS_PER_SECOND.labels(phase).observe(tokens / seconds)
+
+
+def track_queue(name, depth):
+    'Expose depth() as the queue depth gauge for name'
+    QUEUE_DEPTH.labels(name).set_function(depth)
+
+
+def track_models(stats):
+    'Expose stats() ({path: {load_seconds, memory_bytes, ...}}) as per-model gauges'
+    REGISTRY.register(ModelCollector(stats))
+
+
+def render():
+    'Current metrics of this process in the Prometheus text format, and its content type'
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,126 @@
+'''
+Process-wide registry of the biomarker models.
+
+Every model is loaded once per process on first use and shared by all connections. When the file on disk
+changes, the new version is loaded in a background thread while callers keep using the old one.
+Paths ending in .npz are forests compiled by 'manage.py compile_forests'. Load time and memory of every model
+are exported as gauges on /metrics.
+
+'mmap_mode' is passed to 'joblib.load', which memory-maps only the plain numpy arrays of a joblib dump. A pickled
+sklearn forest gains nothing from it: each tree copies its node arrays into its own memory when it is
+unpickled, so every process still holds a full private copy of the forest.
+'''
+import logging
+import os
+import threading
+from time import monotonic, time
+
+import joblib
+
+from .. import config as cf
+from .forest import CompiledForest
+from .metrics import track_models
+
+logger = logging.getLogger(__name__)
+
+
+def _rss_bytes():
+    'Resident set size of this process, or None where /proc is unavailable'
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class ModelRegistry:
+
+    def __init__(self, mmap_mode=None, reload_interval=10.0):
+        # mmap_mode='r' maps plain numpy arrays of joblib dumps; it does not share sklearn trees (see above)
+        self.mmap_mode = mmap_mode
+        self.reload_interval = reload_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._reloading = set()
+
+    def _load(self, path):
+        rss_before = _rss_bytes()
+        start = monotonic()
+        if path.endswith('.npz'):
+            model = CompiledForest.load(path)
+        else:
+            model = joblib.load(path, mmap_mode=self.mmap_mode)
+        load_seconds = monotonic() - start
+        rss_after = _rss_bytes()
+
+        previous = self._entries.get(path)
+        entry = {
+            'model': model,
+            'mtime': os.path.getmtime(path),
+            'loaded_at': time(),
+            'last_checked': monotonic(),
+            'load_seconds': load_seconds,
+            'memory_bytes': rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+            'file_bytes': os.path.getsize(path),
+            'loads': previous['loads'] + 1 if previous else 1,
+        }
+        self._entries[path] = entry
+        logger.info(f"Loaded model {path} in {load_seconds:.2f}s (rss delta: {entry['memory_bytes']} bytes)")
+        return entry
+
+    def _load_lock(self, path):
+        with self._lock:
+            return self._load_locks.setdefault(path, threading.Lock())
+
+    def _reload(self, path):
+        try:
+            with self._load_lock(path):
+                self._load(path)
+        except Exception as e:
+            # Keep serving the previous version if the new file is broken or half-written
+            logger.error(f"Failed to reload model {path}: {e}")
+        finally:
+            with self._lock:
+                self._reloading.discard(path)
+
+    def _check_reload(self, path, entry):
+        now = monotonic()
+        if now - entry['last_checked'] < self.reload_interval:
+            return
+        entry['last_checked'] = now
+        try:
+            changed = os.path.getmtime(path) != entry['mtime']
+        except OSError:
+            return
+        if not changed:
+            return
+        with self._lock:
+            if path in self._reloading:
+                return
+            self._reloading.add(path)
+        logger.info(f"Model file changed on disk, reloading: {path}")
+        threading.Thread(target=self._reload, args=(path,), name='model-reload', daemon=True).start()
+
+    def get(self, path):
+        'Return the model stored at path, loading it on first use'
+        entry = self._entries.get(path)
+        if entry is None:
+            with self._load_lock(path):
+                entry = self._entries.get(path)
+                if entry is None:
+                    entry = self._load(path)
+        elif self.reload_interval is not None:
+            self._check_reload(path, entry)
+        return entry['model']
+
+    def stats(self):
+        'Load-time and memory metrics for every loaded model'
+        return {
+            path: {key: value for key, value in entry.items() if key not in ('model', 'last_checked')}
+            for path, entry in list(self._entries.items())
+        }
+
+
+registry = ModelRegistry(mmap_mode=cf.model_mmap_mode, reload_interval=cf.model_reload_interval)
+track_models(registry.stats)
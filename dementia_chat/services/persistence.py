@@ -0,0 +1,99 @@
+'''
+Write-behind persistence of utterances.
+
+Utterances from every session are buffered in memory and written with one 'bulk_create' when 'batch_size' are
+waiting or every 'flush_interval' seconds, so database latency stays off the reply path. The buffer is flushed
+when a client disconnects and once more when the process exits.
+'''
+import asyncio
+import atexit
+import logging
+import threading
+
+from channels.db import database_sync_to_async
+from django.apps import apps
+from django.utils import timezone
+
+from .. import config as cf
+from .metrics import timed, track_queue
+
+logger = logging.getLogger(__name__)
+
+
+class UtteranceWriter:
+
+    def __init__(self, batch_size=50, flush_interval=1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = None
+        self._task = None
+
+    @property
+    def depth(self):
+        return len(self._buffer)
+
+    def add(self, speaker, text, session_id, timestamp=None):
+        'Queue an utterance said at timestamp (default: now), not when the batch is written'
+        Utterance = apps.get_model('dementia_chat', 'Utterance')
+        timestamp = timezone.now() if timestamp is None else timestamp
+        with self._lock:
+            self._buffer.append(Utterance(speaker=speaker, text=text, session_id=session_id, timestamp=timestamp))
+            full = len(self._buffer) >= self.batch_size
+
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        if full:
+            self._wake.set()
+
+    def _take(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        return batch
+
+    def _write(self, batch):
+        try:
+            with timed('db_write', len(batch)):
+                apps.get_model('dementia_chat', 'Utterance').objects.bulk_create(batch)
+            logger.info(f"Stored {len(batch)} utterances")
+        except Exception as e:
+            logger.error(f"Failed to store {len(batch)} utterances: {e}")
+
+    async def flush(self):
+        batch = self._take()
+        if batch:
+            await database_sync_to_async(self._write)(batch)
+
+    def flush_sync(self):
+        'Blocking flush for use outside the event loop, e.g. at interpreter exit'
+        batch = self._take()
+        if batch:
+            self._write(batch)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+
+@database_sync_to_async
+def open_session(session_id):
+    'Record the start of a conversation, or reopen it when a client resumes the session'
+    apps.get_model('dementia_chat', 'Session').objects.update_or_create(id=session_id, defaults={'ended_at': None})
+
+
+@database_sync_to_async
+def close_session(session_id):
+    'Record the end of a conversation'
+    apps.get_model('dementia_chat', 'Session').objects.filter(id=session_id).update(ended_at=timezone.now())
+
+
+writer = UtteranceWriter(batch_size=cf.db_flush_size, flush_interval=cf.db_flush_interval)
+atexit.register(writer.flush_sync)
+track_queue('db_write', lambda: writer.depth)
@@ -0,0 +1,104 @@
+'''
+Phi-3 chat prompt building and token-budgeted conversation history.
+
+The history window moves in blocks so that consecutive prompts share a prefix, which lets the LLM backends
+reuse their KV cache for it (see services/llm.py).
+'''
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Replies are cut at the end of the assistant turn or the first sentence
+STOP_SEQUENCES = ["<|end|>", ".", "?"]
+
+
+def build_prompt(system_prompt, history, user_utt):
+    'Render the Phi-3 chat template for the given history and new user utterance'
+    input_text = f"<|system|>\n{system_prompt}<|end|>"
+    for turn in history:
+        input_text += render_turn(turn)
+    input_text += f"\n<|user|>\n{user_utt}<|end|>\n<|assistant|>\n"
+    return input_text
+
+
+def render_turn(turn):
+    'One history turn as it appears in the prompt'
+    tag = 'user' if turn['Speaker'] == 'User' else 'assistant'
+    return f"\n<|{tag}|>\n{turn['Utt']}<|end|>"
+
+
+class ConversationHistory:
+    '''
+    Chat history of one session, with the token count of every turn cached when it is added.
+
+    Before each turn the history is trimmed so that the prompt fits 'budget' tokens (the context size minus
+    the tokens reserved for the reply) and holds at most 'max_turns' turns. Trimming drops the oldest turns
+    down to half of both limits rather than just below them, so the prompt prefix (and the KV cache built on
+    it) stays the same for the next few turns. Dropped turns are gone from memory; the full transcript is in
+    the database. An utterance too long to fit even without history is cut to its last words.
+    '''
+
+    def __init__(self, count_tokens, budget, max_turns=5, turns=None):
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.max_turns = max_turns
+        self.turns = []
+        for turn in turns or []:
+            self.append(turn['Speaker'], turn['Utt'], turn.get('Tokens'))
+
+    def __len__(self):
+        return len(self.turns)
+
+    @property
+    def tokens(self):
+        return sum(turn['Tokens'] for turn in self.turns)
+
+    def append(self, speaker, utt, tokens=None):
+        turn = {'Speaker': speaker, 'Utt': utt}
+        turn['Tokens'] = self.count_tokens(render_turn(turn)) if tokens is None else tokens
+        self.turns.append(turn)
+
+    def prompt(self, system_prompt, user_utt):
+        'Prompt for the next user utterance, trimming the history first if it would not fit'
+        base = self.count_tokens(build_prompt(system_prompt, [], user_utt))
+        if base > self.budget:
+            user_utt = self.truncate(system_prompt, user_utt)
+            base = self.count_tokens(build_prompt(system_prompt, [], user_utt))
+        if len(self.turns) > self.max_turns or base + self.tokens > self.budget:
+            self.trim(self.budget - base)
+        return build_prompt(system_prompt, self.turns, user_utt)
+
+    def truncate(self, system_prompt, user_utt):
+        'The last words of user_utt that fit the budget in a prompt without history'
+        words = user_utt.split()
+
+        def fits(start):
+            return self.count_tokens(build_prompt(system_prompt, [], ' '.join(words[start:]))) <= self.budget
+
+        if not fits(len(words)):
+            raise ValueError(f"System prompt alone is over the budget of {self.budget} tokens")
+        # Smallest start that fits: the prompt only gets shorter as words are dropped from the front
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high) // 2
+            if fits(middle):
+                high = middle
+            else:
+                low = middle + 1
+        logger.warning(f"User utterance over the prompt budget of {self.budget} tokens, kept its last "
+                       f"{len(words) - low} of {len(words)} words")
+        return ' '.join(words[low:])
+
+    def trim(self, available):
+        'Drop the oldest turns until at most half of max_turns and of the available tokens are left'
+        tokens = self.tokens
+        drop = 0
+        while drop < len(self.turns) and (
+            len(self.turns) - drop > self.max_turns // 2 or tokens > max(available, 0) // 2
+        ):
+            tokens -= self.turns[drop]['Tokens']
+            drop += 1
+        # Start the window on a user turn
+        if drop < len(self.turns) and self.turns[drop]['Speaker'] != 'User':
+            drop += 1
+        del self.turns[:drop]
@@ -0,0 +1,87 @@
+'''
+Background warm-up of the models and readiness reporting.
+
+Nothing heavy is loaded at import any more. When the ASGI app starts, 'start_warm_up' loads the components
+listed in config.warm_up on a background thread, so the server accepts connections at once while /ready
+answers 503 until every component is loaded. Load balancers then only route traffic to warm workers.
+
+The biomarker models are optional: chat works without them (their scores stay None), so a model that fails
+to load is reported in the status but does not keep the process unready.
+'''
+import logging
+import threading
+from time import perf_counter
+
+from .. import config as cf
+from .model_registry import registry as model_registry
+
+logger = logging.getLogger(__name__)
+
+
+def _load_llm():
+    return cf.llm
+
+
+def _load_models():
+    # One missing model must not stop the other from loading
+    errors = []
+    for path in (cf.prosody_model_path, cf.pronunciation_model_path):
+        try:
+            model_registry.get(path)
+        except Exception as e:
+            errors.append(f"{path}: {e}")
+    if errors:
+        raise RuntimeError('; '.join(errors))
+
+
+COMPONENTS = {
+    'llm': _load_llm,
+    'models': _load_models,
+}
+OPTIONAL = {'models'}
+
+
+class Readiness:
+
+    def __init__(self, components, optional=()):
+        self.components = components
+        self.optional = set(optional)
+        self.status = {name: 'pending' for name in components}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        'Every component loaded, or for optional ones at least tried'
+        return all(
+            status == 'ready' or (name in self.optional and status.startswith('failed'))
+            for name, status in self.status.items()
+        )
+
+    def start(self):
+        'Load every component on a background thread; only the first call does anything'
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='warm-up', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        for name, load in self.components.items():
+            self.status[name] = 'loading'
+            start = perf_counter()
+            try:
+                load()
+            except Exception as e:
+                logger.error(f"Warm-up of {name} failed: {e}")
+                self.status[name] = f"failed: {e}"
+                continue
+            self.status[name] = 'ready'
+            logger.info(f"Warm-up of {name} took {perf_counter() - start:.1f}s")
+
+
+readiness = Readiness({name: COMPONENTS[name] for name in cf.warm_up if name in COMPONENTS}, OPTIONAL)
+
+
+def start_warm_up():
+    readiness.start()
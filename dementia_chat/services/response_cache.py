@@ -0,0 +1,136 @@
+'''
+Cache of assistant replies for repeated patient questions.
+
+Entries are keyed by the normalized utterance (lower case, no punctuation or fillers) and a hash of the
+system prompt and the last 'context_turns' history utterances, so a question is only answered from the cache
+when the conversation around it matches too. The cache is shared by every session, so by default the key
+holds the last turn (usually the reply the patient is answering): "tell me more" after one patient's
+conversation must not get the reply written for another's. 'context_turns=0' opts in to context-free
+replies; utterances shorter than 'min_words' (a bare "yes" or "no") are then not cached at all.
+
+Entries expire after 'ttl' seconds and the least recently used are evicted beyond 'max_entries'. With
+'similarity' set, an utterance whose word set overlaps a cached one in the same context by at least that
+Jaccard ratio is also a hit.
+
+The cache lives in each process; 'max_entries' bounds the memory it takes per worker.
+'''
+import hashlib
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from time import monotonic
+
+from .. import config as cf
+from .biomarkers import FILLER_PATTERN
+from .metrics import RESPONSE_CACHE, RESPONSE_CACHE_ENTRIES
+
+PUNCTUATION = re.compile(r"[^\w\s']")
+
+
+def normalize(utterance):
+    'Lower case, fillers and punctuation removed, single spaces'
+    text = FILLER_PATTERN.sub(' ', PUNCTUATION.sub(' ', utterance.lower()))
+    return ' '.join(text.split())
+
+
+def context_key(system_prompt, history, turns):
+    'Hash of the system prompt and the last turns utterances of the history'
+    recent = [system_prompt] + [normalize(turn['Utt']) for turn in (history[-turns:] if turns > 0 else [])]
+    return hashlib.blake2b('\n'.join(recent).encode('utf-8'), digest_size=8).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(self, system_prompt='', max_entries=1024, ttl=600.0, context_turns=1, min_words=2, similarity=None):
+        self.system_prompt = system_prompt
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.context_turns = context_turns
+        self.min_words = min_words
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        # Normalized utterances cached per context, for near-duplicate lookups
+        self._by_context = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, utterance, history):
+        'Cache key of utterance after history, or None if it should not be cached'
+        text = normalize(utterance)
+        if self.max_entries <= 0 or (not self.context_turns and len(text.split()) < self.min_words):
+            return None
+        return context_key(self.system_prompt, history, self.context_turns), text
+
+    def get(self, utterance, history):
+        'Cached reply to utterance after history, or None'
+        key = self._key(utterance, history)
+        if key is None:
+            return None
+        context, text = key
+        now = monotonic()
+        with self._lock:
+            reply = self._lookup((context, text), now)
+            if reply is not None:
+                RESPONSE_CACHE.labels('hit').inc()
+                return reply
+            if self.similarity:
+                reply = self._nearest(context, text, now)
+                if reply is not None:
+                    RESPONSE_CACHE.labels('near_hit').inc()
+                    return reply
+        RESPONSE_CACHE.labels('miss').inc()
+        return None
+
+    def put(self, utterance, history, reply):
+        key = self._key(utterance, history)
+        if key is None or not key[1] or not reply:
+            return
+        context, text = key
+        with self._lock:
+            self._entries[key] = (reply, monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            self._by_context[context][text] = frozenset(text.split())
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        reply, expires = entry
+        if expires <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return reply
+
+    def _nearest(self, context, text, now):
+        words = frozenset(text.split())
+        if not words:
+            return None
+        best, best_score = None, self.similarity
+        for candidate, candidate_words in self._by_context.get(context, {}).items():
+            score = len(words & candidate_words) / len(words | candidate_words)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return None if best is None else self._lookup((context, best), now)
+
+    def _remove(self, key):
+        del self._entries[key]
+        context, text = key
+        texts = self._by_context[context]
+        texts.pop(text, None)
+        if not texts:
+            del self._by_context[context]
+
+
+response_cache = ResponseCache(
+    system_prompt=cf.prompt,
+    max_entries=cf.response_cache_size,
+    ttl=cf.response_cache_ttl,
+    context_turns=cf.response_cache_context,
+    similarity=cf.response_cache_similarity,
+)
+RESPONSE_CACHE_ENTRIES.set_function(lambda: len(response_cache))
@@ -0,0 +1,91 @@
+'''
+Cross-session micro-batching for the biomarker random forests.
+
+At batch size one, most of 'predict_proba' is fixed dispatch overhead across the trees. Windows from every
+live session are therefore collected for up to 'batch_window' seconds (or 'max_batch' rows) and scored with one
+'predict_proba' call per model; each caller gets back the probability for its own row.
+'''
+import asyncio
+import logging
+from collections import defaultdict
+
+import numpy as np
+
+from .. import config as cf
+from .metrics import timed, track_queue
+from .model_registry import registry as model_registry
+
+logger = logging.getLogger(__name__)
+
+
+def predict(model_path, X):
+    'Positive-class probabilities for the rows of X'
+    return model_registry.get(model_path).predict_proba(X)[:, 1]
+
+
+class BatchScorer:
+
+    def __init__(self, batch_window=0.005, max_batch=64):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queue = None
+        self._task = None
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def score(self, model_path, row):
+        'Probability for one flattened feature window, scored together with concurrent requests'
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((model_path, row, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            groups = defaultdict(list)
+            for model_path, row, future in batch:
+                if not future.done():
+                    groups[model_path].append((row, future))
+
+            for model_path, items in groups.items():
+                X = np.vstack([row for row, _ in items])
+                try:
+                    # Forest evaluation runs on a thread so the event loop keeps serving sessions
+                    with timed('rf_scoring', len(items)):
+                        probabilities = await loop.run_in_executor(None, predict, model_path, X)
+                except Exception as e:
+                    logger.error(f"Error scoring {len(items)} windows with {model_path}: {e}")
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), probability in zip(items, probabilities):
+                    if not future.done():
+                        future.set_result(float(probability))
+
+
+scorer = BatchScorer(batch_window=cf.scoring_batch_window, max_batch=cf.scoring_max_batch)
+track_queue('rf_scoring', lambda: scorer.depth)
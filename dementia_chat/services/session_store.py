@@ -0,0 +1,82 @@
+'''
+Conversation state kept outside the WebSocket process.
+
+Chat history, the history window and the turn-taking / filler accumulators are saved after every turn and on
+disconnect, so a client that reconnects (to any front-end) resumes the same session. With 'REDIS_URL' set the
+state lives in Redis; otherwise an in-memory store stands in for tests and single-process deployments. The URL
+is the one the channel layer uses (settings.REDIS_URL, from the environment or .env), so the two cannot end up
+on different backends.
+'''
+import json
+import logging
+from time import monotonic
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class InMemorySessionStore:
+
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self._states = {}
+
+    async def load(self, session_id):
+        entry = self._states.get(session_id)
+        if entry is None:
+            return None
+        state, expires = entry
+        if expires is not None and expires <= monotonic():
+            del self._states[session_id]
+            return None
+        # Round-trip through JSON so callers never share mutable state, as with Redis
+        return json.loads(state)
+
+    async def save(self, session_id, state, ttl=None):
+        if session_id not in self._states and len(self._states) >= self.max_sessions:
+            self._purge()
+        expires = monotonic() + ttl if ttl else None
+        self._states[session_id] = (json.dumps(state), expires)
+
+    async def delete(self, session_id):
+        self._states.pop(session_id, None)
+
+    def _purge(self):
+        now = monotonic()
+        for session_id, (_, expires) in list(self._states.items()):
+            if expires is not None and expires <= now:
+                del self._states[session_id]
+        if len(self._states) >= self.max_sessions:
+            # Still full: drop the oldest saved sessions
+            for session_id in list(self._states)[:len(self._states) - self.max_sessions + 1]:
+                del self._states[session_id]
+
+
+class RedisSessionStore:
+
+    def __init__(self, url, prefix='dementia_chat:session:'):
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    async def load(self, session_id):
+        state = await self._redis.get(self.prefix + session_id)
+        return None if state is None else json.loads(state)
+
+    async def save(self, session_id, state, ttl=None):
+        await self._redis.set(self.prefix + session_id, json.dumps(state), ex=ttl)
+
+    async def delete(self, session_id):
+        await self._redis.delete(self.prefix + session_id)
+
+
+def get_session_store(url=None):
+    if url:
+        logger.info("Session state kept in Redis")
+        return RedisSessionStore(url)
+    return InMemorySessionStore()
+
+
+store = get_session_store(settings.REDIS_URL)
@@ -0,0 +1,147 @@
+'''
+Buffered, append-only transcript of the desktop conversation ('./Script/Script(<start time>).csv').
+
+Rows are written in the order they are appended, so the file is never re-sorted or reopened per turn. They are
+buffered and written when 'flush_size' are waiting or every 'flush_interval' seconds, and once more when the
+process exits. Each conversation session gets its own file ('rotate'). Besides CSV, long recording runs can
+be written as gzipped CSV or as Parquet (one row group per flush, readable once the file is closed; needs the
+optional 'pyarrow' package).
+'''
+import atexit
+import csv
+import gzip
+import logging
+import os
+import threading
+import time
+
+from .. import config as cf
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ['Speaker', 'Utt', 'Time']
+
+EXTENSIONS = {
+    'csv': '.csv',
+    'csv.gz': '.csv.gz',
+    'parquet': '.parquet',
+}
+
+
+class CsvSink:
+
+    def __init__(self, path, compress=False):
+        if compress:
+            self._file = gzip.open(path, 'wt', encoding='utf-8-sig', newline='')
+        else:
+            self._file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(FIELDS)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        # For gzip this is a sync flush, so e.g. zcat shows every row written so far
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema([(field, pa.string()) for field in FIELDS])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows):
+        columns = dict(zip(FIELDS, map(list, zip(*rows))))
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class TranscriptWriter:
+
+    def __init__(self, directory='./Script', fmt='csv', flush_size=20, flush_interval=5.0):
+        if fmt not in EXTENSIONS:
+            raise ValueError(f"Unknown transcript format: {fmt}")
+        self.directory = directory
+        self.fmt = fmt
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.path = None
+        self._sink = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def depth(self):
+        return len(self._buffer)
+
+    def append(self, speaker, utt, start_time):
+        'Queue one row; the file is opened with the first row of a session'
+        with self._lock:
+            self._buffer.append((speaker, utt, start_time))
+            full = len(self._buffer) >= self.flush_size
+            # Under the lock, so appends from two threads cannot both start a flusher
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='transcript', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stem = os.path.join(self.directory, 'Script(' + time.strftime('%y-%m-%d %H-%M', time.localtime()) + ')')
+        path = stem + EXTENSIONS[self.fmt]
+        # Two sessions started in the same minute get numbered files instead of overwriting each other
+        number = 1
+        while os.path.exists(path):
+            number += 1
+            path = f"{stem}({number}){EXTENSIONS[self.fmt]}"
+        if self.fmt == 'parquet':
+            self._sink = ParquetSink(path)
+        else:
+            self._sink = CsvSink(path, compress=self.fmt == 'csv.gz')
+        self.path = path
+        logger.info(f"Writing transcript to {path}")
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            try:
+                if self._sink is None:
+                    self._open()
+                self._sink.write(rows)
+            except Exception as e:
+                logger.error(f"Failed to write {len(rows)} transcript rows: {e}")
+
+    def rotate(self):
+        'Finish the current file; the next row starts a new one'
+        self.flush()
+        with self._lock:
+            if self._sink is not None:
+                self._sink.close()
+                self._sink = None
+
+    def close(self):
+        self.rotate()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+transcript = TranscriptWriter(cf.script_dir, cf.script_format, cf.script_flush_size, cf.script_flush_interval)
+atexit.register(transcript.close)
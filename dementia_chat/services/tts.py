@@ -2,14 +2,15 @@
 '''
 Synthesize utterances using Microsoft Azure TTS SDK mainly from 'parse_tree.py' file and 'asr.py' file.
 '''
-import azure.cognitiveservices.speech as speechsdk
 import time
-import datetime
 import re
 
 from . import asr
 from .. import config as cf
 
+# Azure Speech SDK, or the scripted stand-in with SPEECH_SDK=fake
+speechsdk = cf.speechsdk
+
 # set API keys
 speech_key, service_region = cf.speech_key, cf.service_region
 speech_config = cf.speech_config
@@ -23,7 +24,6 @@ def synthesize_utt(utterance):
     
     if cf.overlap_check == 0 and utterance != None:
         cf.overlap_check = 1
-        utt_start_time = round(time.time() - cf.game_start_time,5)
         logger.info(f"New utterance is: {utterance}")
         
         # MS Azure TTS / Synthesize text and make it to speak
@@ -38,12 +38,7 @@ def synthesize_utt(utterance):
         print('**********' * 5)
         print()
         
-        start_time = str(datetime.timedelta(seconds=utt_start_time)).split(".")[0]
-
-        one_turn_history = {'Speaker': 'System', 'Utt': utterance, 'Time': start_time}
-        cf.chat_history.append(one_turn_history)
-
-        asr.record_chat()
+        asr.append_chat('System', utterance)
         
         result = speech_synthesizer.speak_text_async(utterance).get()
         utterance = re.sub(r'[^a-zA-Z ]', '', utterance).lower()
@@ -56,6 +51,6 @@ def synthesize_utt(utterance):
             if cancellation_details.reason == speechsdk.CancellationReason.Error:
                 logger.info("Error details: {}".format(cancellation_details.error_details))
         
-        # ToDo: put synthesizer and player in separate threads and queue
+        # ASR_PIPELINED=1 runs synthesis and playback on their own thread instead (see voice_pipeline.py)
         time.sleep(0.1)
         cf.overlap_check = 0
\ No newline at end of file
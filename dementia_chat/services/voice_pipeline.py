@@ -0,0 +1,191 @@
+'''
+Pipelined desktop conversation: listening, replying and speaking on separate threads.
+
+Continuous recognition callbacks put each recognized utterance on a queue. An LLM thread turns utterances into
+replies, and a speech thread synthesizes and plays them, so the next utterance is recognized while the current
+reply is still being generated or spoken. Every utterance gets a sequence number; a reply is only spoken while
+no newer utterance has arrived, and speech that starts while the assistant is talking stops the playback
+(barge-in).
+
+When the audio stream ends the pipeline drains: utterances already recognized are still answered and spoken
+before it shuts down. An exit word stops it at once.
+
+The speech SDK is passed in, so the pipeline runs the same on 'azure.cognitiveservices.speech' and on
+'fake_speech'. This module does not import the app config.
+'''
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def clean_utterance(text):
+    'Drop the trailing punctuation mark the recognizer adds and lower all words'
+    return text.strip().rstrip('.?!').lower()
+
+
+class ConversationPipeline:
+
+    def __init__(self, sdk, speech_config, audio_config, respond, on_utterance=None, language='en-US',
+                 barge_in=True, exit_words=('exit', '종료')):
+        # respond(user_utt) -> reply runs on the LLM thread; on_utterance(speaker, utt) records the transcript
+        self.sdk = sdk
+        self.speech_config = speech_config
+        self.audio_config = audio_config
+        self.respond = respond
+        self.on_utterance = on_utterance
+        self.language = language
+        self.barge_in = barge_in
+        self.exit_words = exit_words
+        self.overlaps = 0
+        self.recognizer = None
+        self.synthesizer = None
+        self._utterances = queue.Queue()
+        self._replies = queue.Queue()
+        self._speaking = threading.Event()
+        self._stopped = threading.Event()
+        self._drain = True
+        self._latest = 0
+        self._threads = []
+
+    def start(self):
+        self.recognizer = self.sdk.SpeechRecognizer(
+            speech_config=self.speech_config, language=self.language, audio_config=self.audio_config
+        )
+        self.synthesizer = self.sdk.SpeechSynthesizer(speech_config=self.speech_config)
+        self.recognizer.recognizing.connect(self._on_recognizing)
+        self.recognizer.recognized.connect(self._on_recognized)
+        self.recognizer.canceled.connect(self._on_canceled)
+        self.recognizer.session_stopped.connect(lambda event: self.stop(drain=True))
+
+        self._threads = [
+            threading.Thread(target=self._generate, name='pipeline-llm', daemon=True),
+            threading.Thread(target=self._speak, name='pipeline-tts', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.recognizer.start_continuous_recognition_async().get()
+        logger.info("Continuous recognition started")
+
+    def run(self):
+        'Start, then block until an exit word, the end of the audio stream or stop()'
+        self.start()
+        try:
+            self._stopped.wait()
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+        finally:
+            self.shutdown()
+
+    def stop(self, drain=False):
+        # Only sets flags, so it is safe to call from SDK callbacks. A stop without drain wins over one with it.
+        if not drain:
+            self._drain = False
+        self._stopped.set()
+
+    @property
+    def _stopping_now(self):
+        return self._stopped.is_set() and not self._drain
+
+    def shutdown(self, timeout=5, drain_timeout=60):
+        'Stop listening, then finish the queued replies if draining or drop them; returns once threads exit'
+        self._stopped.set()
+        if self.recognizer is not None:
+            self.recognizer.stop_continuous_recognition_async().get()
+        if self._stopping_now and self.synthesizer is not None and self._speaking.is_set():
+            self.synthesizer.stop_speaking_async().get()
+        # Each queue is stopped behind what is already on it, the replies only once no more can be generated
+        for thread, items in zip(self._threads, (self._utterances, self._replies)):
+            items.put(_STOP)
+            thread.join(drain_timeout if self._drain else timeout)
+        self._threads = []
+
+    # Recognition callbacks, on the SDK's thread: keep them short
+
+    def _on_recognizing(self, event):
+        if self.barge_in and self._speaking.is_set() and event.result.text:
+            self.overlaps += 1
+            logger.info("User started speaking over the reply, stopping playback")
+            self.synthesizer.stop_speaking_async()
+
+    def _on_recognized(self, event):
+        if event.result.reason != self.sdk.ResultReason.RecognizedSpeech:
+            logger.info(f"No speech could be recognized: {event.result.no_match_details}")
+            return
+        user_utt = clean_utterance(event.result.text)
+        if not user_utt:
+            return
+        print("Recognized: {}".format(user_utt))
+        logger.info('user said: ' + user_utt)
+        if self.on_utterance is not None:
+            self.on_utterance('User', user_utt)
+        if any(word in user_utt for word in self.exit_words):
+            print("Exiting...")
+            self.stop()
+            return
+        # A newer utterance makes every reply not yet spoken stale
+        self._latest += 1
+        self._utterances.put((self._latest, user_utt))
+
+    def _on_canceled(self, event):
+        details = event.cancellation_details
+        logger.info("Speech Recognition canceled: {}".format(details.reason))
+        if details.reason == self.sdk.CancellationReason.Error:
+            logger.info("Error details: {}".format(details.error_details))
+        self.stop(drain=details.reason == self.sdk.CancellationReason.EndOfStream)
+
+    # Worker threads
+
+    def _generate(self):
+        while True:
+            item = self._utterances.get()
+            if item is _STOP or self._stopping_now:
+                return
+            # Utterances that queued up while the LLM was busy are answered together, as one user turn
+            seq, user_utt = item
+            stopping = False
+            while not stopping and not self._utterances.empty():
+                item = self._utterances.get()
+                if item is _STOP:
+                    stopping = True
+                else:
+                    seq, user_utt = item[0], user_utt + ' ' + item[1]
+            if self._stopping_now:
+                return
+            try:
+                reply = self.respond(user_utt)
+            except Exception as err:
+                logger.error("user input parsing failed " + str(err))
+                reply = None
+            if reply:
+                self._replies.put((seq, reply))
+            if stopping:
+                return
+
+    def _speak(self):
+        while True:
+            item = self._replies.get()
+            if item is _STOP or self._stopping_now:
+                return
+            seq, reply = item
+            if seq < self._latest:
+                logger.info(f"Dropped stale reply: {reply}")
+                continue
+            logger.info(f"New utterance is: {reply}")
+            print('System: ', reply)
+            if self.on_utterance is not None:
+                self.on_utterance('System', reply)
+            self._speaking.set()
+            try:
+                result = self.synthesizer.speak_text_async(reply).get()
+            finally:
+                self._speaking.clear()
+            if result.reason == self.sdk.ResultReason.Canceled:
+                details = result.cancellation_details
+                logger.info("Speech synthesis canceled: {}".format(details.reason))
+                if details.reason == self.sdk.CancellationReason.Error:
+                    logger.info("Error details: {}".format(details.error_details))
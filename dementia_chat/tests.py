@@ -1,3 +1,797 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import opensmile
+from django.contrib.auth import get_user_model
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from sklearn.ensemble import RandomForestClassifier
+
+from dementia_chat.management.commands.compile_forests import synthetic_windows
+from dementia_chat.management.commands.loadtest import synthetic_speech
+from dementia_chat.models import Session, Utterance
+from dementia_chat.services import fake_speech, features
+from dementia_chat.services.audio_buffer import FrameRingBuffer
+from dementia_chat.services.biomarkers import FillerCounter
+from dementia_chat.services.export import ExportError, export, parse_bound
+from dementia_chat import config as cf
+from dementia_chat.services.forest import CompiledForest
+from dementia_chat.services.inference import InferenceBusy, InferenceExecutor, InferenceTimeout
+from dementia_chat.services.llm import StubBackend
+from dementia_chat.services.prompt import ConversationHistory
+from dementia_chat.services.readiness import Readiness
+from dementia_chat.services import transcript as transcript_module
+from dementia_chat.services.transcript import TranscriptWriter
+from dementia_chat.services.response_cache import ResponseCache, response_cache
+from dementia_chat.services.voice_pipeline import ConversationPipeline
+from dementia_chat.websocket.consumers import ChatConsumer
+from dementia_chat.websocket.protocol import AUDIO_FRAME, HEADER, FrameError, decode_frame, encode_frame
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'services')
+
+
+class FrameRingBufferTests(SimpleTestCase):
+
+    def frames(self, start, stop, n_features=3):
+        # Frame i holds i in every column, so windows are easy to check
+        return np.repeat(np.arange(start, stop, dtype=np.float32)[:, np.newaxis], n_features, axis=1)
+
+    def test_first_window_after_window_frames(self):
+        ring = FrameRingBuffer(window_frames=10, hop_frames=5, n_features=3)
+        self.assertEqual(ring.push(self.frames(0, 9)), [])
+        self.assertIsNone(ring.latest())
+        windows = ring.push(self.frames(9, 10))
+        self.assertEqual(len(windows), 1)
+        np.testing.assert_array_equal(windows[0], self.frames(0, 10))
+
+    def test_overlapping_windows_every_hop(self):
+        ring = FrameRingBuffer(window_frames=10, hop_frames=4, n_features=3)
+        windows = ring.push(self.frames(0, 23))
+        # Windows end at frames 10, 14, 18 and 22
+        self.assertEqual([window[-1, 0] for window in windows], [9, 13, 17, 21])
+        for window in windows:
+            end = int(window[-1, 0]) + 1
+            np.testing.assert_array_equal(window, self.frames(end - 10, end))
+
+    def test_chunking_does_not_change_windows(self):
+        frames = self.frames(0, 57)
+        whole = FrameRingBuffer(window_frames=12, hop_frames=5, n_features=3).push(frames)
+        ring = FrameRingBuffer(window_frames=12, hop_frames=5, n_features=3)
+        chunked = []
+        for start in range(0, 57, 7):
+            chunked += ring.push(frames[start:start + 7])
+        self.assertEqual(len(whole), len(chunked))
+        for a, b in zip(whole, chunked):
+            np.testing.assert_array_equal(a, b)
+
+    def test_windows_are_copies(self):
+        ring = FrameRingBuffer(window_frames=4, hop_frames=2, n_features=3)
+        window = ring.push(self.frames(0, 4))[0]
+        ring.push(self.frames(4, 8))
+        np.testing.assert_array_equal(window, self.frames(0, 4))
+
+    def test_clear_starts_a_new_window(self):
+        ring = FrameRingBuffer(window_frames=4, hop_frames=2, n_features=3)
+        ring.push(self.frames(0, 6))
+        ring.clear()
+        self.assertEqual(len(ring), 0)
+        self.assertEqual(ring.push(self.frames(6, 9)), [])
+        np.testing.assert_array_equal(ring.push(self.frames(9, 10))[0], self.frames(6, 10))
+
+    def test_invalid_hop(self):
+        with self.assertRaises(ValueError):
+            FrameRingBuffer(window_frames=4, hop_frames=5, n_features=3)
+
+
+class FillerCounterTests(SimpleTestCase):
+
+    def counter(self):
+        counter = FillerCounter(windows=(60, 300), start_time=1000)
+        counter.add('um i went to the uh shop', now=1010)
+        counter.add('hmm', now=1100)
+        counter.add('no fillers here', now=1200)
+        return counter
+
+    def test_counts_fillers(self):
+        counter = FillerCounter(start_time=0)
+        self.assertEqual(counter.add('Um, I uh... ahh, hmm, human', now=1), 4)
+        self.assertEqual(counter.total, 4)
+
+    def test_window_expiry(self):
+        counter = self.counter()
+        self.assertEqual(counter.count(60, now=1100), 1)
+        self.assertEqual(counter.count(300, now=1100), 3)
+        self.assertEqual(counter.count(300, now=1310), 1)
+        self.assertEqual(counter.count(300, now=1400), 0)
+        self.assertEqual(counter.total, 3)
+
+    def test_rate_caps_elapsed_at_window(self):
+        early = FillerCounter(windows=(60,), start_time=1000)
+        early.add('um uh', now=1010)
+        # 20 s into the conversation a 60 s window has only seen 20 s
+        self.assertAlmostEqual(early.rate(60, now=1020), 2 / (20 / 60))
+        counter = self.counter()
+        self.assertAlmostEqual(counter.rate(60, now=1150), 1.0)
+        self.assertAlmostEqual(counter.rate(now=1180), 3 / 3)
+        self.assertEqual(FillerCounter(start_time=5).rate(60, now=5), 0)
+
+    def test_round_trip(self):
+        counter = self.counter()
+        restored = FillerCounter.from_dict(json.loads(json.dumps(counter.to_dict())), counter.windows)
+        self.assertEqual(restored.start_time, counter.start_time)
+        self.assertEqual(restored.total, counter.total)
+        for now in (1100, 1250, 1350):
+            self.assertEqual(restored.rates(now=now), counter.rates(now=now))
+
+    def test_round_trip_with_new_window(self):
+        restored = FillerCounter.from_dict(self.counter().to_dict(), (60, 300, 600))
+        self.assertEqual(restored.count(600, now=1200), 0)
+        self.assertEqual(restored.count(300, now=1200), 3)
+
+
+class AudioFrameTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        samples = np.array([0, 1, -1, 32767, -32768], dtype=np.int16)
+        frame = encode_frame(AUDIO_FRAME, 16000, 2 ** 32 + 5, samples)
+        self.assertEqual(len(frame), HEADER.size + 2 * samples.size)
+        msg_type, sample_rate, sequence, decoded = decode_frame(frame)
+        self.assertEqual((msg_type, sample_rate, sequence), (AUDIO_FRAME, 16000, 5))
+        np.testing.assert_array_equal(decoded, samples)
+
+    def test_empty_payload(self):
+        *_, decoded = decode_frame(encode_frame(AUDIO_FRAME, 16000, 0, []))
+        self.assertEqual(decoded.size, 0)
+
+    def test_short_header(self):
+        with self.assertRaises(FrameError):
+            decode_frame(encode_frame(AUDIO_FRAME, 16000, 0, [])[:HEADER.size - 1])
+
+    def test_odd_payload(self):
+        with self.assertRaises(FrameError):
+            decode_frame(encode_frame(AUDIO_FRAME, 16000, 0, [1, 2]) + b'\x00')
+
+
+class ReducedLLDConfigTests(SimpleTestCase):
+
+    def test_frames_match_compare_2016(self):
+        reduced = opensmile.Smile(
+            feature_set=os.path.join(SERVICES_DIR, 'biomarker_lld.conf'), feature_level='lld',
+            sampling_rate=features.SAMPLE_RATE,
+        )
+        full = features.full_smile()
+        reduced_index = [list(reduced.feature_names).index(name) for name in features.BIOMARKER_FEATURES]
+        full_index = [list(full.feature_names).index(name) for name in features.BIOMARKER_FEATURES]
+        for seed in range(3):
+            signal = features.pcm_to_float(synthetic_speech(3, seed=seed))
+            np.testing.assert_array_equal(
+                reduced(signal, features.SAMPLE_RATE)[0, reduced_index],
+                full(signal, features.SAMPLE_RATE)[0, full_index],
+            )
+
+
+class CompiledForestTests(SimpleTestCase):
+
+    def fit(self, n_classes=2, n_features=6, unused_columns=0, seed=0):
+        rng = np.random.default_rng(seed)
+        X = rng.normal(size=(300, n_features))
+        # The last unused_columns are constant, so no tree can split on them
+        if unused_columns:
+            X[:, -unused_columns:] = 0.0
+        y = (X[:, 0] + X[:, 1] * X[:, 2] > 0).astype(int) + (X[:, 3] > 1) * (n_classes - 2)
+        return RandomForestClassifier(n_estimators=20, max_depth=8, random_state=seed).fit(X, y)
+
+    def assert_parity(self, forest, compiled, X):
+        np.testing.assert_allclose(compiled.predict_proba(X), forest.predict_proba(X), rtol=0, atol=1e-12)
+        np.testing.assert_array_equal(compiled.predict(X), forest.predict(X))
+
+    def test_matches_predict_proba(self):
+        for n_classes in (2, 3):
+            forest = self.fit(n_classes=n_classes)
+            compiled = CompiledForest.from_estimator(forest)
+            X = np.random.default_rng(1).normal(size=(500, 6))
+            self.assert_parity(forest, compiled, X)
+            self.assert_parity(forest, compiled, synthetic_windows(compiled, 500))
+
+    def test_unused_last_feature_keeps_width(self):
+        forest = self.fit(unused_columns=2)
+        compiled = CompiledForest.from_estimator(forest)
+        self.assertEqual(compiled.n_features_in_, 6)
+        X = synthetic_windows(compiled, 200)
+        self.assertEqual(X.shape, (200, 6))
+        self.assert_parity(forest, compiled, X)
+
+    def test_save_and_load(self):
+        forest = self.fit(unused_columns=1)
+        compiled = CompiledForest.from_estimator(forest)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'forest.npz')
+            compiled.save(path)
+            loaded = CompiledForest.load(path)
+        self.assertEqual(loaded.n_features_in_, 6)
+        self.assert_parity(forest, loaded, synthetic_windows(loaded, 200))
+
+
+def count_words(text):
+    'Stand-in tokenizer: one token per word or chat tag'
+    return len(text.replace('<|', ' <|').split())
+
+
+class ConversationHistoryTests(SimpleTestCase):
+
+    def history(self, budget=200, max_turns=4, n_turns=0):
+        history = ConversationHistory(count_words, budget, max_turns)
+        for i in range(n_turns):
+            history.append('User' if i % 2 == 0 else 'System', f'turn {i} with some words')
+        return history
+
+    def test_short_history_kept(self):
+        history = self.history(n_turns=4)
+        prompt = history.prompt('be brief', 'hello there')
+        self.assertEqual(len(history), 4)
+        self.assertIn('turn 0 with', prompt)
+
+    def test_trims_to_half_of_max_turns_from_a_user_turn(self):
+        history = self.history(max_turns=4, n_turns=6)
+        history.prompt('be brief', 'hello there')
+        self.assertEqual([turn['Utt'] for turn in history.turns], ['turn 4 with some words', 'turn 5 with some words'])
+
+    def test_prefix_stable_after_trimming(self):
+        history = self.history(max_turns=4, n_turns=6)
+        first = history.prompt('be brief', 'hello there')
+        history.append('User', 'hello there')
+        history.append('System', 'hi')
+        second = history.prompt('be brief', 'how are you')
+        self.assertTrue(second.startswith(first[:first.index('<|user|>\nhello there')]))
+
+    def test_trims_to_fit_the_token_budget(self):
+        history = self.history(budget=40, max_turns=20, n_turns=10)
+        prompt = history.prompt('be brief', 'hello there')
+        self.assertLessEqual(count_words(prompt), 40)
+        self.assertEqual(history.turns[0]['Speaker'], 'User')
+
+    def test_long_utterance_cut_to_its_last_words(self):
+        history = self.history(budget=30, n_turns=4)
+        utterance = ' '.join(f'word{i}' for i in range(50))
+        prompt = history.prompt('be brief', utterance)
+        self.assertLessEqual(count_words(prompt), 30)
+        self.assertIn('word49<|end|>', prompt)
+        self.assertNotIn('word0 ', prompt)
+
+    def test_system_prompt_over_budget_refused(self):
+        history = self.history(budget=5)
+        with self.assertRaises(ValueError):
+            history.prompt('a system prompt that is much too long', 'hello')
+
+
+class InferenceExecutorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.gate = threading.Event()
+        self.addCleanup(self.gate.set)
+
+    def blocked(self):
+        'Yields one item, then waits for the gate'
+        yield 'first'
+        self.gate.wait(5)
+        yield 'second'
+
+    async def test_full_queue_refused(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=1, timeout=5)
+        running = executor.stream(self.blocked)
+        self.assertEqual(await running.__anext__(), 'first')
+        self.assertEqual(executor.depth, 1)
+        with self.assertRaises(InferenceBusy):
+            await executor.stream(self.blocked).__anext__()
+        self.gate.set()
+        self.assertEqual([item async for item in running], ['second'])
+        self.assertEqual(executor.depth, 0)
+
+    async def test_request_expires_in_queue(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=2, timeout=5)
+        running = executor.stream(self.blocked)
+        await running.__anext__()
+        calls = []
+
+        def never_run():
+            calls.append(1)
+            yield 'too late'
+
+        with self.assertRaises(InferenceTimeout):
+            await executor.stream(never_run, timeout=0.05).__anext__()
+        self.gate.set()
+        self.assertEqual([item async for item in running], ['second'])
+        self.assertEqual(calls, [])
+        self.assertEqual(executor.depth, 0)
+
+    async def test_cancelled_stream_stops_and_closes_producer(self):
+        executor = InferenceExecutor(max_workers=1, max_queue=1, timeout=5)
+        produced, closed, received = [], threading.Event(), asyncio.Event()
+
+        def tokens():
+            try:
+                for i in range(1000):
+                    produced.append(i)
+                    yield str(i)
+                    time.sleep(0.01)
+            finally:
+                closed.set()
+
+        async def consume():
+            async for _ in executor.stream(tokens):
+                received.set()
+
+        task = asyncio.create_task(consume())
+        await received.wait()
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertTrue(await asyncio.to_thread(closed.wait, 2))
+        self.assertLess(len(produced), 10)
+        # The slot is released once produce() returns, just after close()
+        for _ in range(100):
+            if not executor.depth:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(executor.depth, 0)
+
+
+class TranscriptPaginationTests(TestCase):
+
+    def setUp(self):
+        staff = get_user_model().objects.create_user('staff', password='x', is_staff=True)
+        self.client.force_login(staff)
+        self.session = Session.objects.create()
+        start = timezone.now()
+        # Pairs of utterances share a timestamp, so pages must also be ordered and split by id
+        Utterance.objects.bulk_create([
+            Utterance(speaker='User', text=f'utt {i}', session_id=str(self.session.pk),
+                      timestamp=start + timedelta(seconds=i // 2))
+            for i in range(11)
+        ])
+        Utterance.objects.create(speaker='User', text='other session', session_id='other', timestamp=start)
+        self.url = reverse('session_transcript', args=[self.session.pk])
+
+    def test_pages_cover_transcript_in_order(self):
+        texts, after, pages = [], None, 0
+        while True:
+            params = {'limit': 3, **({'after': after} if after else {})}
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            texts += [utterance['text'] for utterance in body['results']]
+            pages += 1
+            after = body['next']
+            if after is None:
+                break
+        self.assertEqual(texts, [f'utt {i}' for i in range(11)])
+        self.assertEqual(pages, 4)
+
+    def test_last_full_page_has_no_next(self):
+        body = self.client.get(self.url, {'limit': 11}).json()
+        self.assertEqual(len(body['results']), 11)
+        self.assertIsNone(body['next'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'after': 'not-a-cursor'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'limit': 0}).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.first, self.second = Session.objects.create(), Session.objects.create()
+        for session, day, hour, text in [
+            (self.first, 1, 10, 'first day'),
+            (self.first, 2, 10, 'second day'),
+            (self.first, 3, 10, 'third day'),
+            (self.second, 2, 11, 'other, "quoted" session'),
+        ]:
+            Utterance.objects.create(speaker='User', text=text, session_id=str(session.pk),
+                                     timestamp=timezone.make_aware(datetime(2024, 5, day, hour)))
+
+    def read_csv(self, **filters):
+        lines = b''.join(export('csv', **filters)).decode('utf-8').splitlines()
+        return list(csv.DictReader(lines))
+
+    def test_csv_filtered_by_date_range(self):
+        rows = self.read_csv(start=parse_bound('2024-05-02'), end=parse_bound('2024-05-03'))
+        self.assertEqual(sorted(row['text'] for row in rows), ['other, "quoted" session', 'second day'])
+        self.assertEqual(list(rows[0]), ['id', 'session_id', 'speaker', 'text', 'timestamp'])
+
+    def test_csv_filtered_by_session(self):
+        rows = self.read_csv(start=parse_bound('2024-05-02'), sessions=[self.first.pk])
+        self.assertEqual([row['text'] for row in rows], ['second day', 'third day'])
+        self.assertEqual({row['session_id'] for row in rows}, {str(self.first.pk)})
+
+    def test_jsonl(self):
+        chunks = export('jsonl', end=parse_bound('2024-05-02T10:30:00'), sessions=[self.first.pk])
+        rows = [json.loads(line) for line in b''.join(chunks).decode('utf-8').splitlines()]
+        self.assertEqual([row['text'] for row in rows], ['first day', 'second day'])
+        self.assertEqual(parse_bound(rows[1]['timestamp']), timezone.make_aware(datetime(2024, 5, 2, 10)))
+
+    def test_parse_bound(self):
+        self.assertIsNone(parse_bound(''))
+        self.assertEqual(parse_bound('2024-05-02'), timezone.make_aware(datetime(2024, 5, 2)))
+        self.assertTrue(timezone.is_aware(parse_bound('2024-05-02T10:30:00')))
+        for value in ['yesterday', '2024-13-01', '2024-05-02T25:00:00']:
+            with self.subTest(value=value), self.assertRaises(ExportError):
+                parse_bound(value)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ExportError):
+            export('xlsx')
+
+    def test_invalid_date_is_bad_request(self):
+        staff = get_user_model().objects.create_user('staff', password='x', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('export_utterances'), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ChatConsumerTests(TransactionTestCase):
+    # Stub replies start after 'latency' seconds, long enough to talk over them
+
+    def setUp(self):
+        patches = [
+            mock.patch.dict(cf.__dict__, {'llm': StubBackend(latency=0.3, token_latency=0.01)}),
+            # Every turn goes to the LLM
+            mock.patch.object(response_cache, 'max_entries', 0),
+            mock.patch.object(cf, 'prosody_model_path', 'dementia_chat/services/missing_model.pkl'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), '/ws/chat/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        message = await communicator.receive_json_from()
+        self.assertEqual(message['type'], 'session')
+        return communicator, message['data']
+
+    async def receive_until(self, communicator, kind, timeout=5):
+        'Messages received up to and including the first one of the given type'
+        messages = []
+        while not messages or messages[-1]['type'] != kind:
+            messages.append(await communicator.receive_json_from(timeout=timeout))
+        return messages
+
+    async def test_connect_survives_missing_model(self):
+        communicator, session_id = await self.connect()
+        await communicator.send_json_to({'type': 'transcription', 'data': 'good morning how are you'})
+        messages = await self.receive_until(communicator, 'llm_response')
+        scores = messages[0]
+        self.assertEqual(scores['type'], 'biomarker_scores')
+        self.assertIsNone(scores['data']['prosody'])
+        self.assertTrue(await Session.objects.filter(pk=session_id).aexists())
+        await communicator.disconnect()
+
+    async def turn(self, stream):
+        'Messages of one turn with LLM_STREAM on or off, and the utterances stored for it'
+        with mock.patch.object(cf, 'llm_stream', stream):
+            communicator, session_id = await self.connect()
+            await communicator.send_json_to({'type': 'transcription', 'data': 'what day is it today'})
+            messages = await self.receive_until(communicator, 'llm_response')
+            await communicator.disconnect()
+        stored = [(u.speaker, u.text) async for u in Utterance.objects.filter(session_id=session_id).order_by('id')]
+        return messages, stored
+
+    async def test_turn_streams_and_stores_reply(self):
+        messages, stored = await self.turn(stream=True)
+        deltas = [message['data'] for message in messages if message['type'] == 'llm_response_delta']
+        reply = messages[-1]['data']
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual(''.join(deltas).strip(), reply)
+        self.assertIn(reply, StubBackend.REPLIES)
+        self.assertEqual(stored, [('User', 'what day is it today'), ('System', reply)])
+
+    async def test_turn_without_streaming_sends_only_the_reply(self):
+        messages, stored = await self.turn(stream=False)
+        kinds = [message['type'] for message in messages if message['type'] != 'periodic_scores']
+        self.assertEqual(kinds, ['biomarker_scores', 'llm_response'])
+        reply = messages[-1]['data']
+        self.assertIn(reply, StubBackend.REPLIES)
+        self.assertEqual(stored, [('User', 'what day is it today'), ('System', reply)])
+
+    async def test_user_utterance_stamped_when_received(self):
+        communicator, session_id = await self.connect()
+        sent = timezone.now()
+        await communicator.send_json_to({'type': 'transcription', 'data': 'what is for lunch'})
+        await self.receive_until(communicator, 'llm_response')
+        await communicator.disconnect()
+        user, system = [u async for u in Utterance.objects.filter(session_id=session_id).order_by('id')]
+        # The stub takes 0.3 s to start replying
+        self.assertLess(user.timestamp - sent, timedelta(seconds=0.2))
+        self.assertGreaterEqual(system.timestamp - user.timestamp, timedelta(seconds=0.25))
+
+    async def test_overlapped_speech_cancels_turn(self):
+        communicator, session_id = await self.connect()
+        await communicator.send_json_to({'type': 'transcription', 'data': 'tell me about my daughter'})
+        await self.receive_until(communicator, 'biomarker_scores')
+        await communicator.send_json_to({'type': 'overlapped_speech'})
+        messages = await self.receive_until(communicator, 'llm_cancelled')
+        self.assertNotIn('llm_response', [message['type'] for message in messages])
+        # No reply follows the cancelled turn
+        self.assertTrue(await communicator.receive_nothing(timeout=0.6))
+        await communicator.disconnect()
+        stored = [(u.speaker, u.text) async for u in Utterance.objects.filter(session_id=session_id)]
+        self.assertEqual(stored, [('User', 'tell me about my daughter')])
+
+    async def test_refused_turn_keeps_utterance(self):
+        busy = mock.patch('dementia_chat.websocket.consumers.generate_reply', side_effect=InferenceBusy('queue full'))
+        with busy:
+            communicator, session_id = await self.connect()
+            await communicator.send_json_to({'type': 'transcription', 'data': 'is anybody there'})
+            messages = await self.receive_until(communicator, 'busy')
+            await communicator.disconnect()
+        self.assertNotIn('llm_response', [message['type'] for message in messages])
+        stored = [(u.speaker, u.text) async for u in Utterance.objects.filter(session_id=session_id)]
+        self.assertEqual(stored, [('User', 'is anybody there')])
+
+    async def test_odd_legacy_audio_chunk_ignored(self):
+        communicator, _ = await self.connect()
+        await communicator.send_json_to({
+            'type': 'audio_data', 'data': base64.b64encode(b'\x00\x01\x02').decode(), 'sampleRate': 16000,
+        })
+        await communicator.send_json_to({'type': 'transcription', 'data': 'are you still there'})
+        messages = await self.receive_until(communicator, 'llm_response')
+        self.assertEqual(messages[0]['type'], 'biomarker_scores')
+        await communicator.disconnect()
+
+    async def test_cancel_while_sending_to_llm_worker_records_once(self):
+        layer = get_channel_layer()
+        sending, release = asyncio.Event(), asyncio.Event()
+        original_send = layer.send
+
+        async def slow_send(channel, message):
+            if message['type'] == 'llm.generate':
+                sending.set()
+                await release.wait()
+            await original_send(channel, message)
+
+        with mock.patch.object(cf, 'remote_workers', True), mock.patch.object(layer, 'send', slow_send):
+            communicator, session_id = await self.connect()
+            await communicator.send_json_to({'type': 'transcription', 'data': 'where is the station'})
+            await asyncio.wait_for(sending.wait(), 5)
+            await communicator.send_json_to({'type': 'overlapped_speech'})
+            await self.receive_until(communicator, 'llm_cancelled')
+            release.set()
+            await communicator.disconnect()
+        stored = [(u.speaker, u.text) async for u in Utterance.objects.filter(session_id=session_id)]
+        self.assertEqual(stored, [('User', 'where is the station')])
+
+    async def test_newer_transcription_replaces_turn(self):
+        communicator, _ = await self.connect()
+        await communicator.send_json_to({'type': 'transcription', 'data': 'where are my glasses'})
+        await self.receive_until(communicator, 'biomarker_scores')
+        await communicator.send_json_to({'type': 'transcription', 'data': 'never mind what time is it'})
+        messages = await self.receive_until(communicator, 'llm_response')
+        kinds = [message['type'] for message in messages]
+        self.assertIn('llm_cancelled', kinds)
+        self.assertEqual(kinds.count('llm_response'), 1)
+        self.assertTrue(await communicator.receive_nothing(timeout=0.6))
+        await communicator.disconnect()
+
+    async def test_cache_keyed_by_history_before_trimming(self):
+        histories = {'get': [], 'put': []}
+
+        def record(method):
+            return lambda user_utt, history, *reply: histories[method].append(list(history))
+
+        # The third turn trims the history while its prompt is built
+        with mock.patch.object(cf, 'history_turns', 2), \
+                mock.patch.object(response_cache, 'get', side_effect=record('get')), \
+                mock.patch.object(response_cache, 'put', side_effect=record('put')):
+            communicator, _ = await self.connect()
+            for user_utt in ['good morning', 'is it raining', 'where is my coat']:
+                await communicator.send_json_to({'type': 'transcription', 'data': user_utt})
+                await self.receive_until(communicator, 'llm_response')
+            await communicator.disconnect()
+        self.assertEqual(len(histories['put']), 3)
+        self.assertEqual(len(histories['put'][2]), 4)
+        self.assertEqual(histories['get'], histories['put'])
+
+
+class ResponseCacheTests(SimpleTestCase):
+
+    def test_hit_ignores_case_punctuation_and_fillers(self):
+        cache = ResponseCache(system_prompt='p')
+        cache.put('What day is it today?', [], 'It is Monday.')
+        self.assertEqual(cache.get('um what day is it today', []), 'It is Monday.')
+
+    def test_different_history_misses_by_default(self):
+        cache = ResponseCache(system_prompt='p')
+        cache.put('tell me more', [{'Speaker': 'System', 'Utt': 'Your daughter called.'}], 'She is visiting.')
+        self.assertIsNone(cache.get('tell me more', [{'Speaker': 'System', 'Utt': 'It is raining.'}]))
+        self.assertIsNone(cache.get('tell me more', []))
+        self.assertEqual(
+            cache.get('tell me more', [{'Speaker': 'System', 'Utt': 'Your daughter called.'}]), 'She is visiting.'
+        )
+
+    def test_context_free_opt_in(self):
+        cache = ResponseCache(system_prompt='p', context_turns=0)
+        cache.put('what day is it', [{'Speaker': 'System', 'Utt': 'Hello.'}], 'Monday.')
+        self.assertEqual(cache.get('what day is it', [{'Speaker': 'System', 'Utt': 'Good night.'}]), 'Monday.')
+
+    def test_short_utterances_not_cached_without_context(self):
+        cache = ResponseCache(system_prompt='p', context_turns=0)
+        cache.put('yes', [], 'Good.')
+        self.assertIsNone(cache.get('yes', []))
+
+    def test_keyed_by_recent_history(self):
+        cache = ResponseCache(system_prompt='p', context_turns=2)
+        history = [
+            {'Speaker': 'User', 'Utt': 'shall we go for a walk'},
+            {'Speaker': 'System', 'Utt': 'That sounds lovely.'},
+        ]
+        cache.put('yes', history, 'Let us get your coat.')
+        self.assertEqual(cache.get('Yes!', [{'Speaker': 'User', 'Utt': 'earlier'}] + history), 'Let us get your coat.')
+        self.assertIsNone(cache.get('yes', history[:1]))
+        self.assertIsNone(cache.get('yes', []))
+
+    def test_keyed_by_system_prompt(self):
+        cache = ResponseCache(system_prompt='p')
+        cache.put('what day is it', [], 'Monday.')
+        self.assertEqual(cache.get('what day is it', []), 'Monday.')
+        cache.system_prompt = 'q'
+        self.assertIsNone(cache.get('what day is it', []))
+
+    def test_least_recently_used_evicted(self):
+        cache = ResponseCache(system_prompt='p', max_entries=2)
+        cache.put('first question here', [], 'One.')
+        cache.put('second question here', [], 'Two.')
+        cache.get('first question here', [])
+        cache.put('third question here', [], 'Three.')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('second question here', []))
+        self.assertEqual(cache.get('first question here', []), 'One.')
+
+
+class ReadinessTests(SimpleTestCase):
+
+    def warm_up(self, components, optional=()):
+        readiness = Readiness(components, optional)
+        readiness.start()
+        readiness._thread.join(5)
+        return readiness
+
+    def missing_model(self):
+        raise FileNotFoundError('prosody_rf(v1).pkl')
+
+    def test_ready_once_loaded(self):
+        readiness = Readiness({'llm': lambda: None})
+        self.assertFalse(readiness.ready)
+        readiness.start()
+        readiness._thread.join(5)
+        self.assertTrue(readiness.ready)
+
+    def test_failed_optional_component_does_not_block(self):
+        readiness = self.warm_up({'llm': lambda: None, 'models': self.missing_model}, optional={'models'})
+        self.assertTrue(readiness.ready)
+        self.assertTrue(readiness.status['models'].startswith('failed'))
+
+    def test_failed_required_component_blocks(self):
+        readiness = self.warm_up({'llm': self.missing_model, 'models': lambda: None}, optional={'models'})
+        self.assertFalse(readiness.ready)
+
+
+class ConversationPipelineTests(SimpleTestCase):
+    # Replies take longer to generate than the scripted utterances take to say
+
+    def run_pipeline(self, script):
+        transcript = []
+
+        def respond(user_utt):
+            time.sleep(0.2)
+            return f'reply to {user_utt}'
+
+        with mock.patch.object(fake_speech.SpeechRecognizer, 'script', script):
+            pipeline = ConversationPipeline(
+                fake_speech, fake_speech.SpeechConfig(), fake_speech.audio.AudioConfig(), respond,
+                on_utterance=lambda speaker, utt: transcript.append((speaker, utt)),
+            )
+            pipeline.run()
+        return pipeline, transcript
+
+    def test_end_of_stream_drains_queued_utterances(self):
+        pipeline, transcript = self.run_pipeline([(0.05, 'Hello.'), (0.05, 'How are you?')])
+        # The first reply is stale once the second utterance is in, the last one is still spoken
+        self.assertEqual(pipeline.synthesizer.spoken, ['reply to how are you'])
+        # Only replies actually spoken are reported, so callers can keep them in the prompt history
+        self.assertEqual(
+            [utt for speaker, utt in transcript if speaker == 'System'], ['reply to how are you']
+        )
+
+    def test_exit_word_stops_at_once(self):
+        pipeline, transcript = self.run_pipeline([(0.05, 'Hello.'), (0.05, 'Exit.')])
+        self.assertEqual(pipeline.synthesizer.spoken, [])
+        self.assertEqual(transcript, [('User', 'hello'), ('User', 'exit')])
+
+
+class TranscriptWriterTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        # Every file opened in the test falls in the same minute
+        minute = mock.patch.object(transcript_module.time, 'strftime', return_value='24-05-01 10-00')
+        minute.start()
+        self.addCleanup(minute.stop)
+
+    def writer(self, **kwargs):
+        writer = TranscriptWriter(self.directory, flush_interval=60, **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def read(self, path, opener=open):
+        with opener(path, 'rt', encoding='utf-8-sig', newline='') as f:
+            return list(csv.reader(f))
+
+    def wait_for_file(self, writer):
+        for _ in range(200):
+            if writer.path is not None and not writer.depth:
+                # Holds the lock until the background flush has finished writing
+                writer.flush()
+                return
+            time.sleep(0.01)
+        self.fail('transcript was not flushed')
+
+    def test_flushes_at_flush_size_in_order(self):
+        writer = self.writer(flush_size=3)
+        writer.append('User', 'hello', '0:00:01')
+        writer.append('System', 'Hi there.', '0:00:02')
+        self.assertIsNone(writer.path)
+        self.assertEqual(writer.depth, 2)
+        writer.append('User', 'how are you', '0:00:05')
+        self.wait_for_file(writer)
+        self.assertEqual(self.read(writer.path), [
+            ['Speaker', 'Utt', 'Time'],
+            ['User', 'hello', '0:00:01'],
+            ['System', 'Hi there.', '0:00:02'],
+            ['User', 'how are you', '0:00:05'],
+        ])
+
+    def test_rotate_starts_a_numbered_file(self):
+        writer = self.writer(flush_size=100)
+        writer.append('User', 'first conversation', '0:00:01')
+        writer.rotate()
+        first = writer.path
+        writer.append('User', 'second conversation', '0:00:01')
+        writer.flush()
+        self.assertEqual(os.path.basename(first), 'Script(24-05-01 10-00).csv')
+        self.assertEqual(os.path.basename(writer.path), 'Script(24-05-01 10-00)(2).csv')
+        self.assertEqual(self.read(first)[1:], [['User', 'first conversation', '0:00:01']])
+        writer.rotate()
+        self.assertEqual(self.read(writer.path)[1:], [['User', 'second conversation', '0:00:01']])
+
+    def test_gzipped_csv(self):
+        writer = self.writer(fmt='csv.gz', flush_size=100)
+        for i in range(5):
+            writer.append('User', f'utterance {i}', f'0:00:0{i}')
+        writer.rotate()
+        self.assertTrue(writer.path.endswith('.csv.gz'))
+        self.assertEqual([row[1] for row in self.read(writer.path, gzip.open)[1:]], [f'utterance {i}' for i in range(5)])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            TranscriptWriter(self.directory, fmt='xlsx')
@@ -3,4 +3,6 @@ from . import views
 
 urlpatterns = [
     path('', views.index, name='index'),
-]
\ No newline at end of file
+    path('sessions/<uuid:session_id>/utterances/', views.session_transcript, name='session_transcript'),
+    path('export/utterances/', views.export_utterances, name='export_utterances'),
+]
@@ -1,5 +1,108 @@
-from django.shortcuts import render
+import base64
+import binascii
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.utils.dateparse import parse_datetime
+
+from .models import Session, Utterance
+from .services.export import CONTENT_TYPES, ExportError, aiter_chunks, export, parse_bound
+from .services import metrics as pipeline_metrics
+from .services.readiness import readiness
+
+TRANSCRIPT_PAGE_SIZE = 50
+TRANSCRIPT_MAX_PAGE_SIZE = 500
+
 
 # Create your views here.
 def index(request):
-    return render(request, 'index.html')
\ No newline at end of file
+    return render(request, 'index.html')
+
+
+def encode_cursor(utterance):
+    'Opaque keyset cursor pointing just after the given utterance'
+    raw = f"{utterance['timestamp'].isoformat()}|{utterance['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        timestamp = parse_datetime(timestamp)
+        if timestamp is None:
+            raise ValueError("bad timestamp")
+        return timestamp, int(pk)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+@staff_member_required
+def session_transcript(request, session_id):
+    '''
+    One page of a session's transcript, oldest first.
+
+    Pages are keyset-paginated on (timestamp, id): pass the returned 'next' cursor as ?after= to get the
+    following page, so every page is a single index range scan however long the conversation is.
+    '''
+    session = get_object_or_404(Session, pk=session_id)
+    try:
+        limit = min(int(request.GET.get('limit', TRANSCRIPT_PAGE_SIZE)), TRANSCRIPT_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        after = decode_cursor(request.GET['after']) if request.GET.get('after') else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    utterances = Utterance.objects.filter(session_id=str(session.pk))
+    if after is not None:
+        timestamp, pk = after
+        utterances = utterances.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+    page = list(utterances.order_by('timestamp', 'id').values('id', 'speaker', 'text', 'timestamp')[:limit + 1])
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    return JsonResponse({
+        'session': {
+            'id': str(session.pk),
+            'started_at': session.started_at,
+            'ended_at': session.ended_at,
+        },
+        'results': page,
+        'next': encode_cursor(page[-1]) if has_more else None,
+    })
+
+
+@staff_member_required
+def export_utterances(request):
+    '''
+    Stream utterances as ?format=csv|jsonl|parquet, optionally limited to ?start= / ?end= (ISO dates or
+    datetimes, end exclusive) and one or more ?session= ids.
+    '''
+    fmt = request.GET.get('format', 'csv')
+    try:
+        chunks = export(
+            fmt,
+            start=parse_bound(request.GET.get('start')),
+            end=parse_bound(request.GET.get('end')),
+            sessions=request.GET.getlist('session'),
+        )
+    except ExportError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Chunks are pulled one at a time on the sync thread, so the export never sits in memory as a whole
+    response = StreamingHttpResponse(aiter_chunks(chunks), content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="utterances.{fmt}"'
+    return response
+
+
+def metrics(request):
+    'Pipeline latencies, queue depths and active sessions of this process, in the Prometheus text format'
+    body, content_type = pipeline_metrics.render()
+    return HttpResponse(body, content_type=content_type)
+
+
+def ready(request):
+    'Readiness probe: 200 once this process has loaded its models, 503 while it is still warming up'
+    return JsonResponse({'ready': readiness.ready, 'components': readiness.status}, status=200 if readiness.ready else 503)
@@ -4,133 +4,407 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from time import time
 import logging
 import random
-import re
-from collections import deque
 import asyncio
 import numpy as np
-import librosa
-import opensmile
-import joblib
+from urllib.parse import parse_qs
+from channels.exceptions import ChannelFull
+from django.utils import timezone
 from .. import config as cf
+from ..services.model_registry import registry as model_registry
+from ..services.scoring import scorer
+from ..services.biomarkers import FillerCounter
+from ..services.persistence import writer as utterance_writer, open_session, close_session
+from ..services.metrics import DROPPED, timed, track_queue
+from ..services.inference import InferenceBusy, count_tokens, forget_session, generate_reply
+from ..services.readiness import readiness
+from ..services.response_cache import response_cache
+from ..services.prompt import ConversationHistory
+from ..services.session_store import store as session_store
+from ..services.audio_buffer import FrameRingBuffer
+from ..services.features import (
+    BIOMARKER_FEATURES, PROSODY_FEATURES, FeatureExtractionPool, SessionExtractor,
+)
+from .protocol import AUDIO_FRAME, FrameError, decode_frame
+from .scheduler import scheduler
 import uuid
-from django.apps import apps
-from channels.db import database_sync_to_async
 
 logger = logging.getLogger(__name__)
 
 # Constants
 WINDOW_SIZE = 5  # seconds
 HOP_LENGTH = 0.01  # 10ms for feature extraction
-SAMPLE_RATE = 16000  # Hz
-
-PROSODY_FEATURES = [
-    'F0final_sma', 'voicingFinalUnclipped_sma',
-    'audspec_lengthL1norm_sma', 'audspecRasta_lengthL1norm_sma',
-    'pcm_RMSenergy_sma', 'pcm_zcr_sma', 'jitterLocal_sma', 
-    'jitterDDP_sma', 'shimmerLocal_sma', 'logHNR_sma'
-]
-
-PRONUNCIATION_FEATURES = [
-    'audSpec_Rfilt_sma[3]', 'audSpec_Rfilt_sma[5]', 'audSpec_Rfilt_sma[9]', 'audSpec_Rfilt_sma[11]', 
-    'audSpec_Rfilt_sma[12]', 'audSpec_Rfilt_sma[16]', 'audSpec_Rfilt_sma[20]', 'audSpec_Rfilt_sma[21]', 
-    'audSpec_Rfilt_sma[23]', 'audSpec_Rfilt_sma[24]', 'audSpec_Rfilt_sma[25]', 'pcm_fftMag_fband250-650_sma', 
-    'pcm_fftMag_spectralCentroid_sma', 'pcm_fftMag_spectralVariance_sma', 'mfcc_sma[5]', 'mfcc_sma[9]', 'mfcc_sma[10]', 
-    'mfcc_sma[13]'
-    ] 
-
-# Initialize feature extractor
-feature_extractor = opensmile.Smile(
-    feature_set=opensmile.FeatureSet.ComParE_2016,
-    feature_level=opensmile.FeatureLevel.LowLevelDescriptors,
-    sampling_rate=SAMPLE_RATE,
+WINDOW_FRAMES = round(WINDOW_SIZE / HOP_LENGTH)
+HOP_FRAMES = round(cf.biomarker_hop / HOP_LENGTH)
+
+# openSMILE runs in worker processes, started on first use
+feature_pool = FeatureExtractionPool(
+    max_workers=cf.feature_workers, config=cf.lld_config, level=cf.lld_level, verify=cf.lld_verify,
 )
+track_queue('opensmile', lambda: feature_pool.depth)
+
+
+class RemoteExtractor:
+    '''
+    SessionExtractor stand-in that sends chunks to a FeatureWorker process over the channel layer.
+
+    Frames come back to the consumer as 'features.frames' events; when the worker's channel is full the chunk
+    is dropped, as SessionExtractor drops the oldest pending chunk.
+    '''
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.dropped = 0
+        self._tasks = set()
+
+    @property
+    def depth(self):
+        return len(self._tasks)
+
+    def submit(self, samples, sample_rate):
+        task = asyncio.create_task(self._send(samples, sample_rate))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, samples, sample_rate):
+        try:
+            await self.consumer.channel_layer.send(cf.feature_channel, {
+                'type': 'features.extract',
+                'reply_channel': self.consumer.channel_name,
+                'samples': samples.astype('<i2').tobytes(),
+                'sample_rate': sample_rate,
+            })
+        except ChannelFull:
+            self.dropped += 1
+            DROPPED.labels('audio_chunk').inc()
+            logger.warning(f"Feature workers busy, dropped audio chunk for {self.consumer.session_id}")
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.client_id = id(self)
         try:
-            # Get the model during runtime instead of import time
-            self.Utterance = apps.get_model('dementia_chat', 'Utterance')
-            # Add session_id for grouping conversation utterances
-            self.session_id = str(uuid.uuid4())
-            # Verify LLM is initialized
-            if not cf.llm:
-                raise RuntimeError("LLM not initialized")
+            # Resume the session named in '?session=' if the shared store still has it
+            query = parse_qs(self.scope.get('query_string', b'').decode())
+            state = await self.load_session(query.get('session', [None])[0])
+            # Models load in the background at startup; until then the first turn waits on the inference thread
+            if not readiness.ready:
+                logger.warning(f"Session {self.session_id} started before warm-up finished: {readiness.status}")
             # Rest of connect code...
             self.conversation_start_time = time()
-            self.user_utterances = deque(maxlen=100)
+            self.last_activity = self.conversation_start_time
+            self.fillers = FillerCounter(cf.anomia_windows, self.conversation_start_time)
             self.overlapped_speech_count = 0
-            self.prosody_features = None
-            self.pronunciation_features = None
-            self.chat_history = []  # Add chat_history as instance variable
+            self.feature_buffer = FrameRingBuffer(WINDOW_FRAMES, HOP_FRAMES, len(BIOMARKER_FEATURES))
+            self.audio_sequence = None
+            if cf.remote_workers:
+                self.feature_extractor = RemoteExtractor(self)
+            else:
+                self.feature_extractor = SessionExtractor(feature_pool, self.on_frames, cf.feature_queue_size)
+            self.prosody_score = None
+            self.pronunciation_score = None
+            # Add chat_history as instance variable, trimmed to what fits the LLM context
+            self.chat_history = self.new_history()
+            # The turn being generated in this process, and turns waiting on an LLM worker by turn number
+            # (with the history their prompt was built on, to key the response cache)
+            self.turn_task = None
+            self.turn_utt = None
+            self.turn_spoken_at = None
+            self.turn = 0
+            self.pending_turns = {}
+            if state:
+                self.restore_state(state)
             await self.accept()
-            self.periodic_scores_task = asyncio.create_task(self.send_periodic_scores())
-            self.prosody_model = joblib.load(cf.prosody_model_path)
-            self.pronunciation_model = joblib.load(cf.pronunciation_model_path)
+            # The client reconnects with ?session=<id> to carry on where it left off
+            await self.send(json.dumps({
+                'type': 'session',
+                'data': self.session_id
+            }))
+            await self.load_models()
+            # Periodic scores only start once the session is fully set up
+            scheduler.register(self)
         except Exception as e:
             logger.error(f"Failed to initialize consumer: {e}")
+            scheduler.unregister(self)
+            await self.close()
             return
 
     async def disconnect(self, close_code):
-        if hasattr(self, 'periodic_scores_task'):
-            self.periodic_scores_task.cancel()
+        scheduler.unregister(self)
+        if hasattr(self, 'chat_history'):
+            await self.cancel_turn('disconnect', notify=False)
+            await self.save_state()
         self.conversation_start_time = None
-        self.user_utterances.clear()
         self.overlapped_speech_count = 0
+        if hasattr(self, 'feature_extractor'):
+            self.feature_extractor.close()
+        if hasattr(self, 'session_id') and not cf.remote_workers:
+            forget_session(self.session_id)
+        await utterance_writer.flush()
+        if hasattr(self, 'session_id'):
+            try:
+                await close_session(self.session_id)
+            except Exception as e:
+                logger.error(f"Failed to close session {self.session_id}: {e}")
         logger.info(f"Client disconnected: {self.client_id}")
 
-    @database_sync_to_async
-    def store_utterance(self, speaker, text):
-        """Store utterance in database asynchronously"""
+    async def load_models(self):
+        'Load the biomarker models (once per process); chat goes on without a model that fails to load'
+        loop = asyncio.get_running_loop()
+        for path in (cf.prosody_model_path, cf.pronunciation_model_path):
+            try:
+                await loop.run_in_executor(None, model_registry.get, path)
+            except Exception as e:
+                # Its score stays None; scoring logs the error again for every window
+                logger.error(f"Failed to load biomarker model {path}: {e}")
+
+    async def load_session(self, requested):
+        'Resume a session saved in the shared store, or start a new one; returns the saved state if any'
+        state = None
+        if requested:
+            try:
+                requested = str(uuid.UUID(requested))
+                state = await session_store.load(requested)
+            except ValueError:
+                logger.warning(f"Ignoring invalid session id: {requested}")
+        # Add session_id for grouping conversation utterances
+        self.session_id = requested if state else str(uuid.uuid4())
+        await open_session(self.session_id)
+        return state
+
+    def session_state(self):
+        'Conversation state shared with the other front-ends'
+        return {
+            'conversation_start_time': self.conversation_start_time,
+            'chat_history': self.chat_history.turns,
+            'overlapped_speech_count': self.overlapped_speech_count,
+            'fillers': self.fillers.to_dict(),
+        }
+
+    def restore_state(self, state):
+        self.conversation_start_time = state['conversation_start_time']
+        self.chat_history = self.new_history(state['chat_history'])
+        self.overlapped_speech_count = state['overlapped_speech_count']
+        self.fillers = FillerCounter.from_dict(state['fillers'], cf.anomia_windows)
+        logger.info(f"Resumed session {self.session_id} with {len(self.chat_history)} utterances")
+
+    async def save_state(self):
         try:
-            self.Utterance.objects.create(
-                speaker=speaker,
-                text=text,
-                session_id=self.session_id
-            )
-            logger.info(f"Stored utterance: {speaker} - {text[:50]}... (Session: {self.session_id})")
+            await session_store.save(self.session_id, self.session_state(), ttl=cf.session_state_ttl)
         except Exception as e:
-            logger.error(f"Failed to store utterance: {e}")
+            logger.error(f"Failed to save state of session {self.session_id}: {e}")
+
+    def new_history(self, turns=None):
+        return ConversationHistory(count_tokens, cf.n_ctx - cf.max_new_tokens, cf.history_turns, turns)
+
+    def build_turn_prompt(self, user_utt):
+        # Prepare input for LLM within the token budget, keeping the prompt prefix stable so the KV cache is reused
+        with timed('prompt_build'):
+            return self.chat_history.prompt(cf.prompt, user_utt)
+
+    async def start_turn(self, user_utt, spoken_at):
+        'Generate the reply as a task, so a later message can cancel it'
+        await self.cancel_turn('new transcription')
+        self.turn_utt = user_utt
+        self.turn_spoken_at = spoken_at
+        self.turn_task = asyncio.create_task(self.process_user_utterance(user_utt, spoken_at))
+
+    async def cancel_turn(self, reason, notify=True):
+        '''
+        Barge-in: abort the reply still being generated.
+
+        Generation stops at its next token and the reply is discarded, so it is neither stored nor added to
+        the history; the user's utterance is kept.
+        '''
+        cancelled = []
+        if self.turn_utt is not None and self.turn_task is not None and not self.turn_task.done():
+            cancelled.append((self.turn_utt, self.turn_spoken_at))
+            self.turn_task.cancel()
+        self.turn_utt = None
+
+        for turn, (user_utt, spoken_at, _) in self.pending_turns.items():
+            cancelled.append((user_utt, spoken_at))
+            try:
+                await self.channel_layer.send(cf.llm_channel, {
+                    'type': 'llm.cancel',
+                    'reply_channel': self.channel_name,
+                    'turn': turn,
+                })
+            except ChannelFull:
+                pass
+        self.pending_turns.clear()
+
+        for user_utt, spoken_at in cancelled:
+            DROPPED.labels('cancelled_turn').inc()
+            self.keep_utterance(user_utt, spoken_at)
+        if cancelled:
+            logger.info(f"Cancelled {len(cancelled)} turn(s) of session {self.session_id}: {reason}")
+            if notify:
+                await self.send(json.dumps({
+                    'type': 'llm_cancelled',
+                    'data': reason
+                }))
+
+    def keep_utterance(self, user_utt, spoken_at):
+        'A turn that gets no reply (cancelled, refused or failed) is still part of the transcript and history'
+        utterance_writer.add('User', user_utt, self.session_id, spoken_at)
+        self.chat_history.append('User', user_utt)
+
+    async def process_user_utterance(self, user_utt, spoken_at):
+        # The prompt build trims chat_history in place, so the cache is read and written with the history as it
+        # was before this turn
+        history = list(self.chat_history.turns)
+        # Repeated questions are answered from the cache without touching the LLM
+        cached = response_cache.get(user_utt, history)
+        if cached is not None:
+            await self.finish_turn(user_utt, spoken_at, cached)
+            return
 
-    async def process_user_utterance(self, user_utt):
         try:
-            # Prepare input for LLM
-            history = self.chat_history[-5:] if len(self.chat_history) > 5 else self.chat_history
-            
-            input_text = f"<|system|>\n{cf.prompt}<|end|>"
-            for turn in history:
-                if turn['Speaker'] == 'User':
-                    input_text += f"\n<|user|>\n{turn['Utt']}<|end|>"
-                else:
-                    input_text += f"\n<|assistant|>\n{turn['Utt']}<|end|>"
-            input_text += f"\n<|user|>\n{user_utt}<|end|>\n<|assistant|>\n"
-            
-            # Generate response using LLM
-            output = cf.llm(input_text, max_tokens=cf.max_length, stop=["<|end|>",".", "?"], echo=True)
-            system_utt = (output['choices'][0]['text'].split("<|assistant|>")[-1]).strip()
-            
-            # Store user utterance
-            await self.store_utterance('User', user_utt)
-            await self.store_utterance('System', system_utt)
-            
-            # Update chat history
-            self.chat_history.append({'Speaker': 'User', 'Utt': user_utt})
-            self.chat_history.append({'Speaker': 'System', 'Utt': system_utt})
-            
-            return system_utt
+            input_text = self.build_turn_prompt(user_utt)
+        except ValueError as e:
+            logger.error(f"Turn refused: {e}")
+            self.turn_utt = None
+            self.keep_utterance(user_utt, spoken_at)
+            await self.send_error()
+            return
+
+        if cf.remote_workers:
+            # An LLM worker replies with llm.delta / llm.result / llm.busy events for this turn
+            self.turn += 1
+            turn = self.turn
+            self.pending_turns[turn] = (user_utt, spoken_at, history)
+            # pending_turns tracks the turn from here on; a cancel while the send below awaits must not find
+            # (and record) it twice
+            self.turn_utt = None
+            try:
+                await self.channel_layer.send(cf.llm_channel, {
+                    'type': 'llm.generate',
+                    'reply_channel': self.channel_name,
+                    'turn': turn,
+                    'session_id': self.session_id,
+                    'prompt': input_text,
+                    'stream': cf.llm_stream,
+                })
+            except ChannelFull as e:
+                # Unless it was cancelled (and recorded) while the send waited
+                if self.pending_turns.pop(turn, None) is not None:
+                    self.keep_utterance(user_utt, spoken_at)
+                    await self.send_busy(e)
+            return
+
+        try:
+            # Generate response using LLM on the inference pool so other sessions keep running
+            system_utt = await generate_reply(self.session_id, input_text, self.send_delta if cf.llm_stream else None)
+        except InferenceBusy as e:
+            self.turn_utt = None
+            self.keep_utterance(user_utt, spoken_at)
+            await self.send_busy(e)
+            return
         except Exception as e:
             logger.error(f"Error in process_user_utterance: {e}")
-            return "I'm sorry, I encountered an error while processing your request."
+            self.turn_utt = None
+            self.keep_utterance(user_utt, spoken_at)
+            await self.send_error()
+            return
+        response_cache.put(user_utt, history, system_utt)
+        await self.finish_turn(user_utt, spoken_at, system_utt)
+
+    async def finish_turn(self, user_utt, spoken_at, system_utt):
+        # From here on the turn is complete and can no longer be cancelled
+        if self.turn_utt is user_utt:
+            self.turn_utt = None
+        # Store both utterances; the writer batches them with other sessions off the reply path. The user's is
+        # stamped with the time it was received, not the time its reply was ready
+        utterance_writer.add('User', user_utt, self.session_id, spoken_at)
+        utterance_writer.add('System', system_utt, self.session_id)
+
+        # Update chat history
+        self.chat_history.append('User', user_utt)
+        self.chat_history.append('System', system_utt)
+
+        await self.send(json.dumps({
+            'type': 'llm_response',
+            'data': system_utt
+        }))
+        await self.save_state()
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        with timed('ws_send'):
+            await super().send(text_data, bytes_data, close)
+
+    async def send_delta(self, delta):
+        await self.send(json.dumps({
+            'type': 'llm_response_delta',
+            'data': delta
+        }))
+
+    async def send_busy(self, reason):
+        logger.warning(f"LLM busy, turn refused: {reason}")
+        DROPPED.labels('llm_turn').inc()
+        await self.send(json.dumps({
+            'type': 'busy',
+            'data': cf.busy_message
+        }))
+
+    async def send_error(self):
+        await self.send(json.dumps({
+            'type': 'llm_response',
+            'data': "I'm sorry, I encountered an error while processing your request."
+        }))
+
+    # Replies from the LLM worker (REMOTE_WORKERS=1)
+
+    async def llm_delta(self, event):
+        if event['turn'] in self.pending_turns:
+            await self.send_delta(event['data'])
+
+    async def llm_result(self, event):
+        pending = self.pending_turns.pop(event['turn'], None)
+        if pending is not None:
+            user_utt, spoken_at, history = pending
+            response_cache.put(user_utt, history, event['data'])
+            await self.finish_turn(user_utt, spoken_at, event['data'])
+
+    async def llm_busy(self, event):
+        pending = self.pending_turns.pop(event['turn'], None)
+        if pending is not None:
+            self.keep_utterance(*pending[:2])
+            await self.send_busy(event['data'])
+
+    async def llm_error(self, event):
+        pending = self.pending_turns.pop(event['turn'], None)
+        if pending is not None:
+            self.keep_utterance(*pending[:2])
+            await self.send_error()
+
+    async def features_frames(self, event):
+        'Frames extracted by a feature worker (REMOTE_WORKERS=1)'
+        frames = np.frombuffer(event['frames'], dtype=np.float32).reshape(event['shape'])
+        await self.on_frames(frames)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        self.last_activity = time()
+        if bytes_data is not None:
+            await self.receive_frame(bytes_data)
+            return
 
-    async def receive(self, text_data):
         try:
-            data = json.loads(text_data)
+            with timed('json_decode'):
+                data = json.loads(text_data)
             
             if data['type'] == 'overlapped_speech':
                 self.overlapped_speech_count += 1
                 logger.info(f"Overlapped speech detected. Count: {self.overlapped_speech_count}")
+                # The patient is talking over the system: stop generating a reply nobody will listen to
+                await self.cancel_turn('overlapped speech')
             
             elif data['type'] == 'transcription':
+                # Stored with the utterance; the reply may take up to LLM_TIMEOUT seconds to arrive
+                spoken_at = timezone.now()
                 user_utt = data['data'].lower()
                 logger.info(f"Received user utterance: {user_utt}")
                 
@@ -141,70 +415,76 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'data': biomarker_scores
                 }))
                 
-                # Generate LLM response
-                response = await self.process_user_utterance(user_utt)
-                await self.send(json.dumps({
-                    'type': 'llm_response',
-                    'data': response
-                }))
+                # Generate LLM response; a newer transcription replaces a reply still being generated
+                await self.start_turn(user_utt, spoken_at)
             
             elif data['type'] == 'audio_data':
-                print("AUDIO DATA RECEIVED")
+                # Legacy clients that send base64 PCM inside JSON
                 await self.process_audio_data(data['data'], data['sampleRate'])
                 
         except json.JSONDecodeError as e:
             logger.error(f"JSON decode error: {e}")
 
+    async def receive_frame(self, bytes_data):
+        try:
+            msg_type, sample_rate, sequence, samples = decode_frame(bytes_data)
+        except FrameError as e:
+            logger.error(f"Invalid binary frame: {e}")
+            return
+
+        if msg_type != AUDIO_FRAME:
+            logger.error(f"Unknown binary frame type: {msg_type}")
+            return
+        if self.audio_sequence is not None and sequence != (self.audio_sequence + 1) & 0xFFFFFFFF:
+            logger.warning(f"Audio frames lost or reordered: expected {self.audio_sequence + 1}, got {sequence}")
+        self.audio_sequence = sequence
+        await self.process_audio_samples(samples, sample_rate)
+
     async def process_audio_data(self, base64_data, sample_rate):
         try:
             # Decode base64 to bytes
-            audio_bytes = base64.b64decode(base64_data)
-            
-            logger.info(f"Received audio data: {len(audio_bytes)} bytes at {sample_rate}Hz")
-        
-            audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
-            
-            # Normalize audio data
-            audio_array = audio_array / np.max(np.abs(audio_array))
-            
-            # Convert to float32
-            audio_array = librosa.util.buf_to_float(audio_array, n_bytes=2, dtype=np.float32)
+            with timed('base64_decode'):
+                audio_bytes = base64.b64decode(base64_data)
+            # Raises ValueError for an odd number of bytes
+            samples = np.frombuffer(audio_bytes, dtype=np.int16)
+        except (ValueError, TypeError) as e:
+            logger.error(f"Error decoding audio data: {e}")
+            return
+        return await self.process_audio_samples(samples, sample_rate)
 
-            features = feature_extractor.process_signal(audio_array, sample_rate)
-            print(f"Extracted features: {features.shape}")
+    async def process_audio_samples(self, samples, sample_rate):
+        logger.info(f"Received audio data: {samples.size} samples at {sample_rate}Hz")
+        # Extraction happens on the process pool; frames come back through on_frames
+        self.feature_extractor.submit(samples, sample_rate)
 
-            self.prosody_features = features[PROSODY_FEATURES]
-            self.pronunciation_features = features[PRONUNCIATION_FEATURES]
+    async def on_frames(self, frames):
+        try:
+            # Only the new audio was extracted; the ring buffer assembles the 5 s windows
+            windows = self.feature_buffer.push(frames)
+            logger.debug(f"Extracted {len(frames)} frames, {len(windows)} new windows")
 
-            return self.prosody_features, self.pronunciation_features
+            if windows:
+                await self.score_window(windows[-1])
         
         except Exception as e:
-            logger.error(f"Error processing audio data: {e}")
-
-    def reshape_data(self, X):
-        'Reshape 3D data to 2D'
-        return X.reshape(X.shape[0], -1)
-
-    def get_probs(self, model, X):
-        'Takes a classif model and returns probability values'
-        probabilities = model.predict_proba(X)[:,1]
-        return probabilities
-    
-    def get_chunks(self, features, chunk_size):
-        'Seperate features in 5-second non-overlapping chunks'
-        return [features.iloc[i:i+chunk_size].values for i in range(0, len(features), chunk_size) if len(features.iloc[i:i+chunk_size]) == chunk_size]
-
-
-    def process_scores(self, features, chunk_size, model):
-        'getting scores from file'
-        chunks = self.get_chunks(features, chunk_size)
-        print(f'\tOriginal features shape: {features.shape}')
-        feature_array = self.reshape_data(np.array(chunks))
-        print(f'\tReshaped features shape: {feature_array.shape}')
-        scores = self.get_probs(model, feature_array)
-        print(f"\tSCORES: {scores}\n")
-        return scores
+            logger.error(f"Error scoring audio features: {e}")
 
+    async def score_window(self, window):
+        'Score one 5-second window of LLD frames with both models, batched with other sessions'
+        n_prosody = len(PROSODY_FEATURES)
+        prosody, pronunciation = await asyncio.gather(
+            scorer.score(cf.prosody_model_path, window[:, :n_prosody].reshape(-1)),
+            scorer.score(cf.pronunciation_model_path, window[:, n_prosody:].reshape(-1)),
+            return_exceptions=True,
+        )
+        if isinstance(prosody, Exception):
+            logger.error(f"Error processing prosody features: {prosody}")
+        else:
+            self.prosody_score = prosody
+        if isinstance(pronunciation, Exception):
+            logger.error(f"Error processing pronunciation features: {pronunciation}")
+        else:
+            self.pronunciation_score = pronunciation
 
     def generate_pragmatic_score(self, user_utt):
         return random.random()
@@ -218,40 +498,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
         return normalized_score
 
     def generate_anomia_score(self):
-        pattern = r'\b(u+h+|a+h+|u+m+|h+m+|h+u+h+|m+h+|h+m+|h+a+h+)\b'
-        all_fillers = []
-        for sentence in self.user_utterances:
-            filler_words = re.findall(pattern, sentence, re.IGNORECASE)
-            all_fillers.extend(filler_words)
-        
-        duration_minutes = (time() - self.conversation_start_time) / 60
-        fillers_per_minute = len(all_fillers) / duration_minutes if duration_minutes > 0 else 0
-        return min(fillers_per_minute / 10, 1)
+        # Fillers are counted as utterances arrive, so this is O(1) however long the conversation
+        return min(self.fillers.rate() / 10, 1)
 
     def generate_prosody_score(self):
-        if self.prosody_features is not None:
-            try:
-                print("\tGenerating prosody score...")
-                chunk_size = int(WINDOW_SIZE / HOP_LENGTH)
-                score = self.process_scores(self.prosody_features, chunk_size, self.prosody_model)
-                return score[0]
-            except Exception as e:
-                logger.error(f"Error processing prosody features: {e}")
-                return random.random()
+        # Score of the latest full window, None until 5 s of audio have arrived
+        return self.prosody_score
 
     def generate_pronunciation_score(self):
-        if self.pronunciation_features is not None:
-            try:
-                print("\tGenerating pronunciation score...")
-                chunk_size = int(WINDOW_SIZE / HOP_LENGTH)
-                score = self.process_scores(self.pronunciation_features, chunk_size, self.pronunciation_model)
-                return score[0]
-            except Exception as e:
-                logger.error(f"Error processing prosody features: {e}")
-                return random.random()
+        return self.pronunciation_score
 
     def generate_biomarker_scores(self, user_utt):
-        self.user_utterances.append(user_utt)
+        self.fillers.add(user_utt)
         return {
             'pragmatic': self.generate_pragmatic_score(user_utt),
             'grammar': self.generate_grammar_score(user_utt),
@@ -259,18 +517,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'pronunciation': self.generate_pronunciation_score()
         }
     
-    async def send_periodic_scores(self):  # Remove websocket parameter
-        while True:
-            await asyncio.sleep(5)
-            if self.conversation_start_time is not None:
-                current_duration = time() - self.conversation_start_time
-                anomia_score = self.generate_anomia_score()
-                turntaking_score = self.generate_turntaking_score()
-                await self.send(json.dumps({  # Use self.send instead
-                    'type': 'periodic_scores',
-                    'data': {
-                        'anomia': anomia_score,
-                        'turntaking': turntaking_score
-                    }
-                }))
-
+    def periodic_scores(self):
+        'Scores sent every tick of the periodic-score scheduler'
+        return {
+            'anomia': self.generate_anomia_score(),
+            'turntaking': self.generate_turntaking_score(),
+            'fillers_per_minute': {
+                str(window): rate for window, rate in self.fillers.rates().items()
+            }
+        }
@@ -1,6 +1,13 @@
 from django.urls import re_path
-from . import consumers
+from . import consumers, workers
+from .. import config as cf
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/$', consumers.ChatConsumer.as_asgi()),
-]
\ No newline at end of file
+]
+
+# Started with 'manage.py runworker llm-inference feature-extraction'
+channel_routes = {
+    cf.llm_channel: workers.LLMWorker.as_asgi(),
+    cf.feature_channel: workers.FeatureWorker.as_asgi(),
+}
@@ -0,0 +1,76 @@
+'''
+One periodic-score scheduler per process.
+
+Instead of every connection sleeping in its own loop, registered consumers are ticked together by a single
+task: scores are computed for every active session in one pass and the messages are sent concurrently.
+Sessions with no inbound message for 'idle_timeout' seconds are skipped until they speak again.
+'''
+import asyncio
+import json
+import logging
+from time import time
+
+from .. import config as cf
+from ..services.metrics import ACTIVE_SESSIONS
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicScoreScheduler:
+
+    def __init__(self, interval=5.0, idle_timeout=60.0):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self._consumers = set()
+        self._task = None
+
+    def __len__(self):
+        return len(self._consumers)
+
+    def register(self, consumer):
+        self._consumers.add(consumer)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def unregister(self, consumer):
+        self._consumers.discard(consumer)
+        if not self._consumers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while self._consumers:
+            # Ticks stay on a fixed cadence however long the previous one took
+            next_tick += self.interval
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Error in periodic scores tick: {e}")
+
+    async def tick(self):
+        now = time()
+        batch = []
+        for consumer in list(self._consumers):
+            if now - consumer.last_activity > self.idle_timeout:
+                continue
+            try:
+                batch.append((consumer, consumer.periodic_scores()))
+            except Exception as e:
+                logger.error(f"Error computing periodic scores for {consumer.session_id}: {e}")
+
+        results = await asyncio.gather(*(
+            consumer.send(json.dumps({'type': 'periodic_scores', 'data': scores}))
+            for consumer, scores in batch
+        ), return_exceptions=True)
+        for (consumer, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to send periodic scores to {consumer.session_id}: {result}")
+                self.unregister(consumer)
+
+
+scheduler = PeriodicScoreScheduler(interval=cf.periodic_scores_interval, idle_timeout=cf.periodic_idle_timeout)
+# Every fully connected session is registered with the scheduler
+ACTIVE_SESSIONS.set_function(lambda: len(scheduler))
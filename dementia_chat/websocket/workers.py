@@ -0,0 +1,87 @@
+'''
+Background workers reached over the channel layer.
+
+With REMOTE_WORKERS=1 the WebSocket consumers send LLM turns to the 'llm-inference' channel and audio chunks
+to 'feature-extraction'; any number of front-ends can share workers started with
+
+    python manage.py runworker llm-inference feature-extraction
+
+Replies go back to the consumer's own channel ('reply_channel'), so they reach the right front-end process.
+'''
+import asyncio
+import logging
+from functools import partial
+
+import numpy as np
+from channels.consumer import AsyncConsumer
+
+from ..services.features import SessionExtractor
+from ..services.inference import InferenceBusy, generate_reply
+from .. import config as cf
+from .consumers import feature_pool
+
+logger = logging.getLogger(__name__)
+
+
+class LLMWorker(AsyncConsumer):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Running turns by (reply channel, turn number), so they can be cancelled
+        self._tasks = {}
+
+    async def llm_generate(self, message):
+        # Channels handles one message at a time per consumer; the inference queue decides what is busy
+        key = (message['reply_channel'], message['turn'])
+        task = asyncio.create_task(self.generate(message))
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+    async def llm_cancel(self, message):
+        # Only reaches the worker process that received the turn when there is a single LLM worker process;
+        # with several, the front-end still discards the reply
+        task = self._tasks.get((message['reply_channel'], message['turn']))
+        if task is not None:
+            task.cancel()
+
+    async def generate(self, message):
+        reply_channel, turn = message['reply_channel'], message['turn']
+
+        async def on_delta(delta):
+            await self.channel_layer.send(reply_channel, {'type': 'llm.delta', 'turn': turn, 'data': delta})
+
+        try:
+            text = await generate_reply(message['session_id'], message['prompt'], on_delta if message['stream'] else None)
+        except InferenceBusy as e:
+            await self.channel_layer.send(reply_channel, {'type': 'llm.busy', 'turn': turn, 'data': str(e)})
+        except Exception as e:
+            logger.error(f"Error generating reply for {message['session_id']}: {e}")
+            await self.channel_layer.send(reply_channel, {'type': 'llm.error', 'turn': turn})
+        else:
+            await self.channel_layer.send(reply_channel, {'type': 'llm.result', 'turn': turn, 'data': text})
+
+
+class FeatureWorker(AsyncConsumer):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # One extractor per front-end connection keeps its chunks in order and drops the oldest when behind
+        self._extractors = {}
+
+    async def features_extract(self, message):
+        for reply_channel in [name for name, extractor in self._extractors.items() if extractor.idle]:
+            del self._extractors[reply_channel]
+
+        reply_channel = message['reply_channel']
+        extractor = self._extractors.get(reply_channel)
+        if extractor is None:
+            extractor = SessionExtractor(feature_pool, partial(self.send_frames, reply_channel), cf.feature_queue_size)
+            self._extractors[reply_channel] = extractor
+        extractor.submit(np.frombuffer(message['samples'], dtype='<i2'), message['sample_rate'])
+
+    async def send_frames(self, reply_channel, frames):
+        await self.channel_layer.send(reply_channel, {
+            'type': 'features.frames',
+            'frames': frames.tobytes(),
+            'shape': list(frames.shape),
+        })
@@ -9,9 +9,10 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from dementia_chat.websocket import routing
+from dementia_chat.services.readiness import start_warm_up
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'interface_app.settings')
 
@@ -22,4 +23,8 @@ application = ProtocolTypeRouter({
             routing.websocket_urlpatterns
         )
     ),
+    "channel": ChannelNameRouter(routing.channel_routes),
 })
+
+# Load the LLM and biomarker models in the background; /ready turns 200 once they are in memory
+start_warm_up()
@@ -75,6 +75,27 @@ WSGI_APPLICATION = 'interface_app.wsgi.application'
 
 ASGI_APPLICATION = 'interface_app.asgi.application'
 
+# Channel layer shared by the WebSocket front-ends and the LLM / feature workers.
+# Without REDIS_URL everything runs in one process on the in-memory layer. The session store
+# (dementia_chat/services/session_store.py) reads this setting too.
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
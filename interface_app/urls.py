@@ -16,8 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from dementia_chat import views as dementia_chat_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', dementia_chat_views.metrics, name='metrics'),
+    path('ready', dementia_chat_views.ready, name='ready'),
     path('', include('dementia_chat.urls')),
 ]